@@ -13,9 +13,12 @@
 #       - Reconfigure the Gammu config file /home/pi/.gammurc with (Baudrate, Default number)
 #       - Declare authorized phone numbers for SMS Control
 #       - Create variables with GSM infos: IMEI, Model, Firmware, etc... 
-#       - Makes use of a send_sms.sh, and call.sh scripts to prevent gammu process collision 
+#       - Every outbound SMS goes through one in-process queue (rate limited, retried) to prevent gammu process collision 
 #       - 
-#       - The heartbeat will check received SMS and Network connectivity (may be conflicting with RaspiSMS for SMS webhooks)
+#       - Received SMS, jamming and network connectivity are checked by scheduled jobs (may be conflicting with RaspiSMS for SMS webhooks)
+#       - The modem is polled by a background worker, the heartbeat only applies the results to the devices
+#       - The UART is owned by one AT session opened in onStart (the gammu CLI stays as a fallback backend)
+#       - Several GSM modules : one session, worker and set of devices per module, outbound SMS spread over the healthy ones
 #       -  Notification based on priority. Prioriy High will be sent by SMS to the 1st user in list. Priority Emergency will be sent to everyone. 
 #       -
 #   Requirements : 
@@ -44,6 +47,7 @@
         <b>Parameters :</b>
         <ul style="list-style-type:square">
         <li>UART Port: please select a 'USB-like' port recognized by Domoticz</li>
+        <li>Additional GSM modules: other UART ports, comma separated, optionally with their own pin code ('/dev/ttyUSB1,/dev/ttyUSB2:1234'). Each module gets its own devices, received SMS are read on all of them and outbound SMS are spread over the modules that are registered and not jammed. Domoticz stores this field as the TCP port of the hardware : entries that are not device paths (such as '0') are ignored, and a module that cannot be opened is left out</li>
         <li>Baudrate: Select the baudrate usually 9600 to 19200. If there are error, try to lower the baudrate. This have been tested up to 115200 baud.</li>
         <li>Pin number: to unlock sim card. Defaults are '1234' or '0000'. Leave empty if the number was cleared before. <b>Warning</b>: check twice your pin code, as it might lock the SIM card</li>
         <li>APN: Not used in SMS mode. Should be used in the near future to provide an internet access in case of Ethernet failure or No Ethernet.</li>
@@ -66,6 +70,7 @@
     </description>
     <params>        
         <param field="SerialPort" label="GSM module UART port" required="true" default="/dev/ttyUSB_ttyS1" width="300px"/>
+        <param field="Port" label="Additional GSM modules UART ports (optionnal)" width="300px" required="false" default=""/>
         <param field="Mode1" label="Baudrate" width="300px" required="true">
             <options>
                 <option label="2400 baud" value="at2400" />
@@ -96,31 +101,1330 @@ import json
 import time
 import datetime
 import os
-import psutil
 import subprocess
 import sys
+import threading
+import queue
+import collections
+import contextlib
+import hashlib
+import concurrent.futures
 from shutil import copy2
 import re
 from unidecode import unidecode
 import requests
+import requests.adapters
 
 import serial
-ser=None
 SerialConn = None
 hasConnected = False
 
 #variable : unitID 
 uid_GSMinfo=1
 uid_SMS=2
-#uid_netstat=3
+uid_netstat=3
 uid_jamming=4
+uid_polltime=5
+uid_stats=6
+uid_signal=7
+uid_cellid=8
+#Signal quality (%) change below which the device is not updated
+signal_deadband=5
+#Network state --> Domoticz alert level
+network_levels={'home network':1, 'roaming network':2, 'searching':3, 'requesting network':3}
 #List Switch On state 
-list_switch_On=['allumer','on','light','lightup','1','power']
-list_switch_Off=['eteindre','off','lightoff','cutoff','0']
-list_switch_Toggle=['toggle','togle','change','changer','basculer','invert','switch','inverser']
+list_switch_On=frozenset(['allumer','on','light','lightup','1','power'])
+list_switch_Off=frozenset(['eteindre','off','lightoff','cutoff','0'])
+list_switch_Toggle=frozenset(['toggle','togle','change','changer','basculer','invert','switch','inverser'])
+#Domoticz heartbeat (s) : only applies the worker results, the modem jobs have their own schedule
+heartbeat_interval=5
+#Latency statistics : samples kept per stage, devices refreshed (and debug dump) every stats_heartbeats heartbeats
+stats_samples=100
+stats_heartbeats=60
+
+class StageTimings:
+    #Rolling durations of each stage (heartbeat, modem commands, HTTP calls...) and event counters
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.counters = collections.Counter()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time()-start)
+
+    def add(self, name, duration):
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = collections.deque(maxlen=stats_samples)
+            self.samples[name].append(duration)
+            self.counters[name] += 1
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def percentiles(self, name):
+        #(p50, p95, max) in ms over the kept samples
+        with self.lock:
+            values = sorted(self.samples.get(name, []))
+        if len(values) == 0:
+            return 0, 0, 0
+        return tuple(int(1000*v) for v in (values[int(0.5*(len(values)-1))], values[int(round(0.95*(len(values)-1)))], values[-1]))
+
+    def report(self):
+        #The workers add new stages while the plugin thread builds the report : names and counters are copied first
+        with self.lock:
+            stages = sorted(self.samples)
+            counters = dict(self.counters)
+        lines = []
+        for name in stages:
+            p50, p95, vmax = self.percentiles(name)
+            lines.append(name+': n='+str(counters[name])+' p50='+str(p50)+'ms p95='+str(p95)+'ms max='+str(vmax)+'ms')
+        for name in sorted(set(counters)-set(stages)):
+            lines.append(name+': '+str(counters[name]))
+        return '\n'.join(lines)
+
+timings = StageTimings()
+
+#Run the modem poll cycle in a background worker (False : poll directly in onHeartbeat)
+use_worker=True
+#The worker checks the schedule and the +CMTI new message indications every push_interval seconds
+push_interval=0.5
+#onStop waits at most stop_timeout seconds in all for the workers and the SMS senders
+stop_timeout=5
+#Modem jobs : name -> [interval (s), priority (lower runs first)]
+schedule_jobs={'sms':[20, 0], 'jamming':[60, 1], 'network':[60, 2], 'identify':[21600, 3]}
+#With push mode the SMS job is only a safety sweep
+sms_sweep_interval=300
+#While the modem is busy the intervals are doubled, up to schedule_backoff_max times
+schedule_backoff_max=8
+#After a command SMS, the SMS job runs every schedule_fast_interval s for schedule_fast_duration s
+schedule_fast_interval=5
+schedule_fast_duration=120
+
+class Scheduler:
+    #Per-job interval and priority, backoff while the modem is busy, faster SMS polling after a command
+    def __init__(self, jobs):
+        self.lock = threading.Lock()
+        self.jobs = dict((name, {'interval':job[0], 'priority':job[1], 'due':0, 'running':False}) for name, job in jobs.items())
+        self.backoff = 1
+        self.fast_until = 0
+
+    def due(self, now):
+        #Jobs due now by priority, a job still running from the last cycle is skipped
+        with self.lock:
+            names = [name for name, job in self.jobs.items() if job['due'] <= now and not job['running']]
+            names.sort(key=lambda name: self.jobs[name]['priority'])
+            for name in names:
+                self.jobs[name]['running'] = True
+            return names
+
+    def done(self, name, now):
+        with self.lock:
+            job = self.jobs[name]
+            job['running'] = False
+            interval = job['interval']*self.backoff
+            if name == 'sms' and now < self.fast_until:
+                interval = min(interval, schedule_fast_interval)
+            job['due'] = now+interval
+
+    def setInterval(self, name, interval):
+        with self.lock:
+            self.jobs[name]['interval'] = interval
+
+    def busy(self):
+        with self.lock:
+            self.backoff = min(self.backoff*2, schedule_backoff_max)
+
+    def idle(self):
+        with self.lock:
+            self.backoff = 1
+
+    def commandReceived(self, now):
+        with self.lock:
+            self.fast_until = now+schedule_fast_duration
+            self.jobs['sms']['due'] = min(self.jobs['sms']['due'], now+schedule_fast_interval)
+#Recovery tiers tried in turn while the modem keeps failing, outcomes kept in the history
+recovery_tiers=['serial', 'session', 'full']
+recovery_history=20
+#Minimum delay (s) between two full reinitializations
+recovery_full_interval=600
+
+class ModemWorker(threading.Thread):
+    #Background thread running the scheduled jobs of one modem (BasePlugin.runCycle), results are queued for the plugin thread
+    def __init__(self, plugin, modem):
+        threading.Thread.__init__(self, name="GammuDz_worker"+modem.suffix, daemon=True)
+        self.plugin = plugin
+        self.modem = modem
+        self.trigger = threading.Event()
+        self.running = True
+
+    def run(self):
+        while self.running:
+            self.trigger.wait(push_interval)
+            self.trigger.clear()
+            if not self.running:
+                break
+            try:
+                self.plugin.runCycle(self.modem)
+            except Exception as e:
+                self.plugin.emit('log', self.modem.label+" worker error: " + str(e))
+
+    def stop(self):
+        self.running = False
+        self.trigger.set()
+
+#Modem session backend : 'serial' keeps one AT channel open on the UART, 'cli' forks /usr/bin/gammu for every call
+session_backend='serial'
+#Paths can be overridden from the environment (GAMMUDZ_*) to run the plugin against a simulated modem
+gammu_bin=os.environ.get('GAMMUDZ_GAMMU', '/usr/bin/gammu')
+gammu_config=os.environ.get('GAMMUDZ_GAMMURC', '/home/pi/.gammurc')
+reset_script=os.environ.get('GAMMUDZ_RESET', '/home/pi/domoticz/scripts/python/i2c_actions.py')
+gammu_cmd=[gammu_bin, '--config', gammu_config]
+#Gammu CLI : timeout (s) of each command, gammu_timeout for the others
+gammu_timeouts={'getallsms':60, 'sendsms':60, 'identify':20}
+gammu_timeout=30
+#AT final result codes
+at_final_ok=('OK',)
+at_final_error=('ERROR','+CME ERROR','+CMS ERROR','NO CARRIER')
+#Unsolicited result codes, kept aside while waiting for a command response. With AT+CREG=2 the module
+#reports the cell changes with +CREG:, which is only a response line for AT+CREG? itself
+at_unsolicited=('+CMTI:','RING','+CLIP:','+CREG:')
+#SMS listing headers : the line after one of them is the SMS data (PDU or text), never a result code
+at_data_headers=('+CMGL:','+CMGR:')
+#Serial read timeout (s) : reads return as soon as data is there, this only bounds an idle wait
+at_read_timeout=0.05
+
+class ATChannel:
+    #AT response framer : bytes are read into one reusable buffer, a response ends on its final
+    #result code and unsolicited lines received meanwhile are kept aside
+    def __init__(self, ser, unsolicited=None):
+        self.ser = ser
+        self.buffer = bytearray()
+        self.unsolicited = unsolicited if unsolicited is not None else []
+
+    def readLine(self, deadline):
+        #Next complete line, '>' for the SMS prompt, None once the deadline is passed
+        while True:
+            end = self.buffer.find(b'\n')
+            if end >= 0:
+                line = self.buffer[:end].decode('ascii', 'replace').strip()
+                del self.buffer[:end+1]
+                return line
+            if self.buffer.strip() == b'>':
+                del self.buffer[:]
+                return '>'
+            waiting = self.ser.in_waiting
+            if waiting == 0 and time.time() >= deadline:
+                return None
+            self.buffer += self.ser.read(waiting or 1)
+
+    def command(self, cmd, timeout=5, payload=None):
+        #Send an AT command and read until a final result code. Returns (ok, [lines])
+        lines = []
+        data = False
+        unsolicited = tuple(code for code in at_unsolicited if not cmd.upper().startswith('AT'+code[:-1]))
+        deadline = time.time()+timeout
+        try:
+            self.ser.write((cmd+'\r').encode('ascii'))
+            while True:
+                line = self.readLine(deadline)
+                if line is None:
+                    break
+                if data and not line.startswith(unsolicited):
+                    #An SMS reading 'OK' or 'ERROR' is still the SMS
+                    lines.append(line)
+                    data = False
+                    continue
+                if line == '' or line == cmd:
+                    continue
+                if line == '>' and payload is not None:
+                    self.ser.write(payload+b'\x1a')
+                    payload = None
+                    continue
+                if line.startswith(unsolicited):
+                    self.unsolicited.append(line)
+                    continue
+                if line in at_final_ok:
+                    return True, lines
+                lines.append(line)
+                data = line.startswith(at_data_headers)
+                if line.startswith(at_final_error):
+                    return False, lines
+        except Exception as e:
+            lines.append('Error: '+str(e))
+        return False, lines
+
+    def pollUnsolicited(self):
+        #Frame whatever arrived without a command, returns the pending unsolicited lines
+        try:
+            line = self.readLine(time.time())
+            while line is not None:
+                if line.startswith(at_unsolicited):
+                    self.unsolicited.append(line)
+                line = self.readLine(time.time())
+        except Exception as e:
+            pass
+        lines = list(self.unsolicited)
+        del self.unsolicited[:]
+        return lines
+
+#Domoticz JSON API : keep-alive connection, timeout of every call (s), lifetime of the device states cache (s)
+dz_url=os.environ.get('GAMMUDZ_URL', 'http://127.0.0.1:8080/json.htm')
+dz_timeout=5
+dz_cache_ttl=5
+
+class DomoticzAPI:
+    #Pooled HTTP client for the Domoticz JSON API, device states are fetched in bulk and cached
+    def __init__(self, url):
+        self.url = url
+        self.http = requests.Session()
+        self.http.mount('http://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.lock = threading.Lock()
+        self.devices = {}
+        self.devices_time = 0
+
+    def get(self, params):
+        with timings.stage('http'):
+            return self.http.get(self.url, params=params, timeout=dz_timeout)
+
+    def command(self, param, **kwargs):
+        params = {'type':'command', 'param':param}
+        params.update(kwargs)
+        return self.get(params)
+
+    def switchLight(self, idx, switchcmd, level=None):
+        if level is None:
+            r = self.command('switchlight', idx=idx, switchcmd=switchcmd)
+        else:
+            r = self.command('switchlight', idx=idx, switchcmd=switchcmd, level=level)
+        self.invalidate()
+        return r
+
+    def setUserVariable(self, name, value):
+        #Update first, the variable is only created when it does not exist yet
+        r = self.command('updateuservariable', vname=name, vtype=2, vvalue=value)
+        if r.status_code != 200 or r.json().get('status') != 'OK':
+            r = self.command('adduservariable', vname=name, vtype=2, vvalue=value)
+        return r
+
+    def device(self, idx):
+        #State of one device from the bulk 'type=devices' answer, refreshed after dz_cache_ttl seconds
+        with self.lock:
+            if time.time()-self.devices_time > dz_cache_ttl:
+                r = self.get({'type':'devices', 'filter':'all'})
+                r.raise_for_status()
+                self.devices = dict((str(dev['idx']), dev) for dev in r.json().get('result', []))
+                self.devices_time = time.time()
+            return self.devices.get(str(idx))
+
+    def invalidate(self):
+        with self.lock:
+            self.devices_time = 0
+
+    def close(self):
+        self.http.close()
+
+#Outbound SMS : sends per minute, delays (s) before each retry, number of delivery status kept
+sms_rate_per_minute=6
+sms_retry_delays=[5, 30, 120]
+sms_status_history=50
+#The reply to a restart command is waited for at most this many seconds before rebooting
+sms_restart_reply_timeout=30
+
+class SMSOutbox:
+    #Single queue for every outbound SMS : identical pending messages are coalesced per recipient.
+    #One sender thread per modem takes the next due message, so the sends are spread over the modems
+    #and a modem jammed or not registered is skipped while another one is usable. Sends are rate
+    #limited per modem and failed sends are retried with backoff, possibly by another modem
+    def __init__(self, modems, emit):
+        self.modems = modems
+        self.emit = emit
+        self.cond = threading.Condition()
+        self.pending = collections.OrderedDict()
+        self.status = collections.OrderedDict()
+        self.next_id = 0
+        self.running = True
+        self.senders = [threading.Thread(target=self.run, args=(modem,), name="GammuDz_outbox"+modem.suffix, daemon=True) for modem in modems]
+
+    def start(self):
+        for sender in self.senders:
+            sender.start()
+
+    def send(self, number, text):
+        #Queue a SMS and return immediately with its id
+        with self.cond:
+            key = (number, text)
+            if key in self.pending:
+                self.pending[key]['count'] += 1
+                return self.pending[key]['id']
+            self.next_id += 1
+            #ids : this SMS and those merged into it, they all get its outcome
+            self.pending[key] = {'id':self.next_id, 'ids':[self.next_id], 'number':number, 'text':text, 'attempts':0, 'due':0, 'count':1}
+            self.setStatus(self.next_id, 'queued')
+            self.cond.notify_all()
+            return self.next_id
+
+    def wait(self, sms_id, timeout):
+        #Wait until the SMS is sent or has failed, returns its last status
+        deadline = time.time()+timeout
+        with self.cond:
+            while self.running and self.status.get(sms_id, 'sent') not in ('sent', 'failed'):
+                remaining = deadline-time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            return self.status.get(sms_id)
+
+    def setStatus(self, sms_id, status):
+        self.status[sms_id] = status
+        self.status.move_to_end(sms_id)
+        while len(self.status) > sms_status_history:
+            self.status.popitem(last=False)
+
+    def usable(self, modem):
+        #An unhealthy modem only sends when no modem is healthy
+        return modem.healthy() or not any(other.healthy() for other in self.modems)
+
+    def nextMessage(self, modem):
+        #Wait until a message is due and the rate limit of the modem allows a send
+        with self.cond:
+            while self.running:
+                now = time.time()
+                while len(modem.sent_times) > 0 and now-modem.sent_times[0] > 60:
+                    modem.sent_times.popleft()
+                wait = None
+                if len(self.pending) > 0:
+                    if not self.usable(modem):
+                        #Health is checked again later
+                        wait = heartbeat_interval
+                    else:
+                        key = min(self.pending, key=lambda k: self.pending[k]['due'])
+                        wait = self.pending[key]['due']-now
+                        if len(modem.sent_times) >= sms_rate_per_minute:
+                            wait = max(wait, modem.sent_times[0]+60-now)
+                        if wait <= 0:
+                            modem.sent_times.append(now)
+                            return self.pending.pop(key)
+                self.cond.wait(wait)
+            return None
+
+    def run(self, modem):
+        while self.running:
+            message = self.nextMessage(modem)
+            if message is None:
+                break
+            try:
+                with timings.stage('sendsms'):
+                    ok = modem.session.sendSMS(message['number'], message['text'])
+            except Exception as e:
+                ok = False
+            message['attempts'] += 1
+            with self.cond:
+                if ok:
+                    for sms_id in message['ids']:
+                        self.setStatus(sms_id, 'sent')
+                    self.cond.notify_all()
+                    self.emit('debug', 'SMS '+str(message['id'])+' sent to '+message['number']+' by '+modem.label+(' (x'+str(message['count'])+' coalesced)' if message['count'] > 1 else ''))
+                elif message['attempts'] <= len(sms_retry_delays):
+                    message['due'] = time.time()+sms_retry_delays[message['attempts']-1]
+                    key = (message['number'], message['text'])
+                    queued = self.pending.get(key)
+                    if queued is None:
+                        self.pending[key] = message
+                        for sms_id in message['ids']:
+                            self.setStatus(sms_id, 'retry '+str(message['attempts']))
+                    else:
+                        #The same SMS was queued during the send : one message for both, sent as the queued one
+                        queued['count'] += message['count']
+                        queued['ids'].extend(message['ids'])
+                        for sms_id in message['ids']:
+                            self.setStatus(sms_id, self.status.get(queued['id'], 'queued'))
+                    self.cond.notify_all()
+                else:
+                    for sms_id in message['ids']:
+                        self.setStatus(sms_id, 'failed')
+                    self.cond.notify_all()
+                    self.emit('log', 'SMS '+str(message['id'])+' to '+message['number']+' failed after '+str(message['attempts'])+' attempts')
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+            dropped = len(self.pending)
+        if dropped > 0:
+            self.emit('log', str(dropped)+' queued SMS dropped')
+
+#Notification routing : priority -> number of recipients taken from the head of the phone list (None : everyone)
+notify_routes={1:1, 2:None}
+#The same text to the same phone is only sent once per notify_dedup_window seconds
+notify_dedup_window=300
+#Notifications to one phone are merged into one digest SMS sent notify_digest_delay s after the first one
+notify_digest_delay=30
+#At most notify_quota SMS per phone every notify_quota_period seconds (Emergency is never held back)
+notify_quota=10
+notify_quota_period=3600
+#Priority sent at once and exempt from the quota
+notify_urgent=2
+
+class NotificationRouter:
+    #Routes Domoticz notifications to phones : per priority recipient lists, dedup, digest and quotas.
+    #Only used from the plugin thread
+    def __init__(self, phones):
+        phones = [ph.strip() for ph in phones.split(',') if ph.strip() != '']
+        self.routes = dict((priority, phones if count is None else phones[:count]) for priority, count in notify_routes.items())
+        self.seen = {}
+        self.buffers = collections.OrderedDict()
+        self.sent = collections.defaultdict(collections.deque)
+
+    def notify(self, priority, text, now):
+        #Buffer the text for each recipient of the priority, returns the number of recipients
+        recipients = self.routes.get(priority, [])
+        for number in recipients:
+            key = (number, text)
+            if now-self.seen.get(key, -notify_dedup_window) < notify_dedup_window:
+                timings.count('notify_duplicate')
+                continue
+            self.seen[key] = now
+            buf = self.buffers.setdefault(number, {'first':now, 'texts':[], 'urgent':False})
+            buf['texts'].append(text)
+            buf['urgent'] = buf['urgent'] or priority >= notify_urgent
+        return len(recipients)
+
+    def flush(self, now):
+        #Digests due for sending, as (number, text)
+        out = []
+        for number in list(self.buffers):
+            buf = self.buffers[number]
+            if not buf['urgent'] and now-buf['first'] < notify_digest_delay:
+                continue
+            del self.buffers[number]
+            texts = buf['texts']
+            sent = self.sent[number]
+            while len(sent) > 0 and now-sent[0] > notify_quota_period:
+                sent.popleft()
+            if not buf['urgent'] and len(sent) >= notify_quota:
+                timings.count('notify_quota', len(texts))
+                continue
+            sent.append(now)
+            if len(texts) > 1:
+                timings.count('notify_merged', len(texts)-1)
+                out.append((number, str(len(texts))+' notifications:\n'+'\n'.join(texts)))
+            else:
+                out.append((number, texts[0]))
+        for key in [key for key, t in self.seen.items() if now-t >= notify_dedup_window]:
+            del self.seen[key]
+        return out
+
+#One SMS, or one reassembled multipart sequence. udh is None or (reference, part, total)
+SMSRecord = collections.namedtuple('SMSRecord', ['locations', 'sender', 'date', 'udh', 'text'])
+
+def parseGammuSMS(output):
+    #Single pass over the 'gammu getallsms' output, yields one SMSRecord per stored SMS part
+    location = None
+    fields = {}
+    body = None
+    for line in output.splitlines():
+        start = re.match(r'Location (\d+), folder "', line)
+        if start or re.match(r'\d+ SMS parts in \d+ SMS sequences', line):
+            if location is not None:
+                yield makeSMSRecord(location, fields, body)
+            location = start.group(1) if start else None
+            fields = {}
+            body = None
+        elif location is None:
+            continue
+        elif body is not None:
+            body.append(line)
+        elif line.strip() == '':
+            #Blank line closes the header, the text follows
+            if len(fields) > 0:
+                body = []
+        elif ' : ' in line:
+            name, value = line.split(' : ', 1)
+            fields[name.strip()] = value.strip()
+    if location is not None:
+        yield makeSMSRecord(location, fields, body)
+
+def makeSMSRecord(location, fields, body):
+    udh = None
+    part = re.search(r'ID \((?:8|16) bit\) (\d+), part (\d+) of (\d+)', fields.get('User Data Header', ''))
+    if part:
+        udh = (int(part.group(1)), int(part.group(2)), int(part.group(3)))
+    text = '\n'.join(body if body is not None else []).strip('\n')
+    return SMSRecord((location,), fields.get('Remote number', '').strip('"'), fields.get('Sent', '').split(' +')[0].strip(), udh, text)
+
+def reassembleSMS(records):
+    #Join the parts of concatenated SMS, in order of arrival of their first part.
+    #Incomplete sequences are returned with the parts received so far.
+    sequences = collections.OrderedDict()
+    for record in records:
+        key = (record.sender, record.udh[0], record.udh[2]) if record.udh is not None else record.locations
+        sequences.setdefault(key, []).append(record)
+    messages = []
+    for key, parts in sequences.items():
+        if parts[0].udh is None:
+            messages.extend(parts)
+            continue
+        parts.sort(key=lambda part: part.udh[1])
+        locations = tuple(loc for part in parts for loc in part.locations)
+        messages.append(SMSRecord(locations, parts[0].sender, parts[0].date, (key[1], len(parts), key[2]), ''.join(part.text for part in parts)))
+    return messages
+
+#Device actions of one SMS run in parallel on this many threads
+command_workers=4
+
+#Incomplete multipart SMS are left on the SIM for this many sweeps before being processed as they are
+sms_incomplete_sweeps=3
+
+class SMSJournal:
+    #On-disk list of the SMS already processed but not yet deleted from the SIM : a crash between
+    #the command and the deletion must not run the command twice
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = set()
+        try:
+            with open(path) as f:
+                self.done = set(json.load(f))
+        except (IOError, ValueError):
+            pass
+
+    def key(self, sms):
+        return hashlib.sha1((sms.sender+'|'+sms.date+'|'+sms.text).encode('utf-8')).hexdigest()
+
+    def isDone(self, sms):
+        with self.lock:
+            return self.key(sms) in self.done
+
+    def markDone(self, sms):
+        with self.lock:
+            self.done.add(self.key(sms))
+            self.save()
+
+    def forget(self, messages):
+        with self.lock:
+            self.done.difference_update(self.key(sms) for sms in messages)
+            self.save()
+
+    def save(self):
+        tmp = self.path+'.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(sorted(self.done), f)
+        os.replace(tmp, self.path)
+
+#Startup cache in the plugin folder : module identity and user variables, kept while the config is unchanged
+startup_cache_file='startup_cache.json'
+
+def startupKey(*params):
+    return hashlib.sha1('|'.join(str(p) for p in params).encode('utf-8')).hexdigest()
+
+class StartupCache:
+    #What a warm restart can reuse : the module identity and the user variables already pushed.
+    #Dropped as soon as the key (backend, ports, baudrate, gammu config) differs
+    def __init__(self, path, key):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = {}
+        try:
+            with open(path) as f:
+                self.data = json.load(f)
+        except (IOError, ValueError):
+            pass
+        if self.data.get('key') != key:
+            self.data = {'key':key}
+
+    def get(self, name, default=None):
+        with self.lock:
+            return self.data.get(name, default)
+
+    def set(self, name, value):
+        with self.lock:
+            self.data[name] = value
+            self.save()
+
+    def save(self):
+        tmp = self.path+'.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.data, f)
+        os.replace(tmp, self.path)
+
+#GSM 03.38 default alphabet and its extension table (escaped by 0x1B)
+gsm_alphabet = "@\u00a3$\u00a5\u00e8\u00e9\u00f9\u00ec\u00f2\u00c7\n\u00d8\u00f8\r\u00c5\u00e5\u0394_\u03a6\u0393\u039b\u03a9\u03a0\u03a8\u03a3\u0398\u039e\x1b\u00c6\u00e6\u00df\u00c9" \
+    " !\"#\u00a4%&'()*+,-./0123456789:;<=>?\u00a1ABCDEFGHIJKLMNOPQRSTUVWXYZ\u00c4\u00d6\u00d1\u00dc\u00a7\u00bfabcdefghijklmnopqrstuvwxyz\u00e4\u00f6\u00f1\u00fc\u00e0"
+gsm_extension = {'^':0x14, '{':0x28, '}':0x29, '\\':0x2F, '[':0x3C, '~':0x3D, ']':0x3E, '|':0x40, '\u20ac':0x65}
+
+def gsmSeptets(text):
+    #Septets of the text in the GSM default alphabet, None if a character is not in it
+    septets = []
+    for c in text:
+        code = gsm_alphabet.find(c)
+        if code >= 0:
+            septets.append(code)
+        elif c in gsm_extension:
+            septets.extend([0x1B, gsm_extension[c]])
+        else:
+            return None
+    return septets
+
+def packSeptets(septets, fill_bits=0):
+    out = bytearray()
+    acc = 0
+    nbits = fill_bits
+    for septet in septets:
+        acc |= septet << nbits
+        nbits += 7
+        while nbits >= 8:
+            out.append(acc & 0xFF)
+            acc >>= 8
+            nbits -= 8
+    if nbits > 0:
+        out.append(acc & 0xFF)
+    return bytes(out)
+
+def encodeSMS(number, text, reference):
+    #SMS-SUBMIT PDUs (hex, TPDU length) for the text, split into concatenated parts when needed.
+    #GSM 7-bit when possible, UCS2 otherwise.
+    septets = gsmSeptets(text)
+    if septets is not None:
+        single, part_size = 160, 153
+        units = septets
+    else:
+        single, part_size = 70, 67
+        units = [text.encode('utf-16-be')[i:i+2] for i in range(0, len(text.encode('utf-16-be')), 2)]
+    if len(units) <= single:
+        parts = [units]
+    else:
+        parts = []
+        while len(units) > 0:
+            size = part_size
+            #Never split an escape sequence, nor a UTF-16 surrogate pair (emoji)
+            if septets is not None and units[size-1:size] == [0x1B]:
+                size -= 1
+            elif septets is None and len(units) > size and 0xD8 <= units[size-1][0] <= 0xDB:
+                size -= 1
+            parts.append(units[:size])
+            units = units[size:]
+    digits = number.lstrip('+')
+    address = ('91' if number.startswith('+') else '81')+''.join(((digits+'F')[i+1]+digits[i]) for i in range(0, len(digits), 2))
+    pdus = []
+    for seq, part in enumerate(parts, 1):
+        udh = b''
+        if len(parts) > 1:
+            udh = bytes([5, 0, 3, reference & 0xFF, len(parts), seq])
+        if septets is not None:
+            fill = (7-(len(udh)*8) % 7) % 7
+            ud = udh+packSeptets(part, fill)
+            udl = (len(udh)*8+fill)//7+len(part)
+            dcs = 0x00
+        else:
+            ud = udh+b''.join(part)
+            udl = len(ud)
+            dcs = 0x08
+        tpdu = bytes([0x41 if udh else 0x01, 0x00, len(digits)])+bytes.fromhex(address)+bytes([0x00, dcs, udl])+ud
+        pdus.append(('00'+tpdu.hex().upper(), len(tpdu)))
+    return pdus
+
+def unpackSeptets(data, count):
+    value = int.from_bytes(data, 'little')
+    return [(value >> (7*i)) & 0x7F for i in range(count)]
+
+def gsmText(septets):
+    #Default alphabet septets to text, 0x1B escapes the next one into the extension table
+    extension = dict((code, c) for c, code in gsm_extension.items())
+    text = []
+    escape = False
+    for septet in septets:
+        if escape:
+            text.append(extension.get(septet, ' '))
+            escape = False
+        elif septet == 0x1B:
+            escape = True
+        else:
+            text.append(gsm_alphabet[septet])
+    return ''.join(text)
+
+def decodePDU(location, pdu):
+    #SMS-DELIVER PDU (hex, with the SMSC) read in PDU mode into an SMSRecord, None for the other PDU types.
+    #The date is formatted as in text mode : yy/MM/dd,hh:mm:ss+zz
+    data = bytes.fromhex(pdu)
+    i = 1+data[0]
+    first = data[i]
+    if first & 0x03 != 0:
+        return None
+    digits, address_type = data[i+1], data[i+2]
+    address = data[i+3:i+3+(digits+1)//2]
+    i += 3+(digits+1)//2
+    if address_type & 0x70 == 0x50:
+        sender = gsmText(unpackSeptets(address, digits*4//7))
+    else:
+        sender = ''.join('%X%X' % (b & 0x0F, b >> 4) for b in address)[:digits]
+        if address_type & 0x70 == 0x10:
+            sender = '+'+sender
+    dcs = data[i+1]
+    scts = ['%X%X' % (b & 0x0F, b >> 4) for b in data[i+2:i+9]]
+    zone = data[i+8]
+    date = '/'.join(scts[0:3])+','+':'.join(scts[3:6])+('-' if zone & 0x08 else '+')+'%02d' % ((zone & 0x07)*10+(zone >> 4))
+    udl = data[i+9]
+    ud = data[i+10:]
+    #Alphabet of the DCS : 0 GSM 7-bit, 1 8-bit data, 2 UCS2
+    if dcs & 0xC0 == 0:
+        charset = (dcs >> 2) & 0x03
+    elif dcs & 0xF0 == 0xF0:
+        charset = 1 if dcs & 0x04 else 0
+    elif dcs & 0xF0 == 0xE0:
+        charset = 2
+    else:
+        charset = 0
+    udh = None
+    header = 0
+    if first & 0x40:
+        header = 1+ud[0]
+        j = 1
+        while j+1 < header:
+            iei, length = ud[j], ud[j+1]
+            if iei == 0x00 and length == 3:
+                udh = (ud[j+2], ud[j+4], ud[j+3])
+            elif iei == 0x08 and length == 4:
+                udh = ((ud[j+2] << 8) | ud[j+3], ud[j+5], ud[j+4])
+            j += 2+length
+    if charset == 0:
+        text = gsmText(unpackSeptets(ud, udl)[(header*8+6)//7:])
+    elif charset == 2:
+        text = ud[header:udl].decode('utf-16-be', 'replace')
+    else:
+        text = ud[header:udl].decode('latin-1')
+    return SMSRecord((str(location),), sender, date, udh, text)
+
+def parseNetworkInfo(network_info):
+    #'Name : value' lines of networkinfo (gammu or AT session) into a dict
+    info = {}
+    for line in network_info.split('\n'):
+        if ' : ' in line:
+            name, value = line.split(' : ', 1)
+            info[name.strip()] = value.strip().strip('"')
+    return info
+
+def buildCommandIndex(name_idx):
+    #Aho-Corasick automaton of the normalized Mode5 names : a trie where a terminal node holds (name, idx) under
+    #the '' key, 'fail' links each node to its longest proper suffix in the trie and 'out' holds the longest
+    #name ending there. Names are single characters keys, so these keys never collide with them
+    trie = {'max':0}
+    for n_idx in name_idx.split(','):
+        if ':' not in n_idx:
+            continue
+        key, key_idx = n_idx.split(':', 1)
+        if key == '':
+            continue
+        node = trie
+        for c in key:
+            node = node.setdefault(c, {})
+        node[''] = (key, key_idx)
+        trie['max'] = max(trie['max'], len(key))
+    #Breadth first, so that the fail node of a node is complete before it
+    trie['fail'] = None
+    trie['out'] = None
+    pending = collections.deque([trie])
+    while len(pending) > 0:
+        node = pending.popleft()
+        for c, child in node.items():
+            if len(c) != 1:
+                continue
+            fail = node['fail']
+            while fail is not None and c not in fail:
+                fail = fail['fail']
+            child['fail'] = fail[c] if fail is not None else trie
+            child['out'] = child[''] if '' in child else child['fail']['out']
+            pending.append(child)
+    return trie
+
+def matchCommand(trie, sms_cmd):
+    #Longest configured name at the earliest position of the command line. Returns (name, idx, rest) or None.
+    #One pass over the line : O(len(sms_cmd)), stopping once no earlier match can start
+    best = None
+    best_start = len(sms_cmd)
+    node = trie
+    for pos, c in enumerate(sms_cmd):
+        if pos-trie['max']+1 > best_start:
+            break
+        while node is not trie and c not in node:
+            node = node['fail']
+        node = node.get(c, trie)
+        found = node['out']
+        if found is not None:
+            start = pos-len(found[0])+1
+            if start < best_start or (start == best_start and len(found[0]) > len(best[0])):
+                best = found+(sms_cmd[pos+1:],)
+                best_start = start
+    return best
+
+class ATSession:
+    #Long-lived AT command channel, opened once in onStart and reused for every modem access
+    persistent = True
+    ready = False
+    push = False
+    def __init__(self, port, baudrate):
+        self.port = port
+        self.baudrate = baudrate
+        self.ser = None
+        self.channel = None
+        self.lock = threading.RLock()
+        self.unsolicited = []
+        self.reference = 0
+        self.stopping = False
+
+    def openPort(self):
+        try:
+            self.ser = serial.Serial(port=self.port, baudrate=self.baudrate, timeout=at_read_timeout)
+        except Exception as e:
+            self.ser = None
+            return False
+        #ESC cancels a SMS input left waiting for its PDU by an interrupted send (stop, crash), the modem would
+        #take the next commands as the SMS content
+        try:
+            self.ser.write(b'\x1b')
+            time.sleep(0.1)
+            self.ser.reset_input_buffer()
+        except Exception:
+            pass
+        self.channel = ATChannel(self.ser, self.unsolicited)
+        return True
+
+    def open(self):
+        if not self.openPort():
+            return False
+        #test AT
+        retry = 10
+        while retry>0:
+            if self.command('AT', 1)[0]:
+                break
+            retry-=1
+        if retry == 0:
+            return False
+        #No echo, SMS PDU mode (concatenated parts come with their header), network location in +CREG, jamming detection option
+        for cmd in ['ATE0', 'AT+CMGF=0', 'AT+CSCS="GSM"', 'AT+CREG=2', 'AT+SJDR=1,0,255']:
+            self.command(cmd)
+        #New SMS indications : +CMTI: "SM",<index>
+        self.push = self.command('AT+CNMI=2,1,0,0,0')[0]
+        self.ready = True
+        return True
+
+    def close(self):
+        with self.lock:
+            if self.ser is not None:
+                try:
+                    self.ser.close()
+                except Exception:
+                    pass
+                self.ser = None
+                self.channel = None
+
+    def stop(self):
+        #From onStop, without the session lock : closing the port makes the command in progress fail at once,
+        #and no command is sent after it
+        self.stopping = True
+        ser = self.ser
+        if ser is not None:
+            try:
+                ser.close()
+            except Exception:
+                pass
+
+    def resetLink(self):
+        #Recovery tier 1 : reopen the serial port only, the whole session if it was never initialized
+        with self.lock:
+            if self.stopping:
+                return False
+            if not self.ready:
+                return self.reopen()
+            self.close()
+            if not self.openPort():
+                return False
+            return self.command('AT', 1)[0] or self.command('AT', 1)[0]
+
+    def reopen(self):
+        #Recovery tier 2 : reopen and reinitialize the whole session
+        with self.lock:
+            if self.stopping:
+                return False
+            self.close()
+            self.ready = False
+            return self.open()
+
+    def command(self, cmd, timeout=5, payload=None):
+        #Send an AT command and read until a final result code. Returns (ok, [lines])
+        with self.lock:
+            if self.channel is None or self.stopping:
+                return False, []
+            return self.channel.command(cmd, timeout, payload)
+
+    def at(self, cmd):
+        return self.command(cmd)[1]
+
+    def pollUnsolicited(self):
+        #Returns the unsolicited lines received since the last call
+        with self.lock:
+            if self.channel is None:
+                return []
+            return self.channel.pollUnsolicited()
+
+    def readSMS(self, index):
+        #One stored part, its udh tells whether it belongs to a concatenated SMS
+        ok, lines = self.command('AT+CMGR='+str(index), 10)
+        if not ok or len(lines) < 2 or not lines[0].startswith('+CMGR:'):
+            return None
+        try:
+            return decodePDU(index, lines[1])
+        except (ValueError, IndexError):
+            return None
+
+    def deleteSMS(self, locations):
+        #All the deletions in one hold of the session, returns the deleted locations
+        with self.lock:
+            return [loc for loc in locations if self.command('AT+CMGD='+str(loc), 10)[0]]
+
+    def enterPin(self, pin):
+        ok, lines = self.command('AT+CPIN?')
+        if ok and 'READY' in str(lines):
+            return 'none'
+        ok, lines = self.command('AT+CPIN="'+pin+'"', 10)
+        return 'ok' if ok else 'error'
+
+    def identify(self):
+        info = []
+        for name, cmd in [['Manufacturer','AT+CGMI'], ['Model','AT+CGMM'], ['Firmware','AT+CGMR'], ['IMEI','AT+CGSN'], ['SIM IMSI','AT+CIMI']]:
+            ok, lines = self.command(cmd)
+            if ok and len(lines) > 0:
+                info.append([name, lines[0].split(':')[-1].strip()])
+        return info
+
+    def networkInfo(self):
+        ok_reg, reg = self.command('AT+CREG?')
+        ok_ops, ops = self.command('AT+COPS?')
+        if not (ok_reg and ok_ops):
+            return 'Error: no answer from the GSM module'
+        states = {'0':'not registered', '1':'home network', '2':'searching', '3':'registration denied', '5':'roaming network'}
+        info = []
+        for line in reg:
+            if line.startswith('+CREG:'):
+                fields = line.split(':')[1].strip().replace('"', '').split(',')
+                info.append('Network state        : '+states.get(fields[1], 'unknown') if len(fields) > 1 else '')
+                if len(fields) > 3:
+                    info.append('LAC                  : '+fields[2])
+                    info.append('CID                  : '+fields[3])
+        for line in ops:
+            if line.startswith('+COPS:') and '"' in line:
+                info.append('Network              : '+line.split('"')[1])
+        return '\n'.join(info)
+
+    def signalQuality(self):
+        #Signal quality in %, None if unknown
+        ok, lines = self.command('AT+CSQ')
+        for line in lines:
+            if line.startswith('+CSQ:'):
+                rssi = int(line.split(':')[1].split(',')[0])
+                if rssi <= 31:
+                    return int(rssi*100/31)
+        return None
+
+    def getAllSMS(self):
+        #Returns ('ok'|'busy', [SMSRecord])
+        ok, lines = self.command('AT+CMGL=4', 20)
+        if not ok:
+            return 'busy', []
+        records = []
+        for header, pdu in zip(lines, lines[1:]):
+            index = re.match(r'\+CMGL:\s*(\d+),', header)
+            if index:
+                try:
+                    sms = decodePDU(index.group(1), pdu)
+                except (ValueError, IndexError):
+                    continue
+                if sms is not None:
+                    records.append(sms)
+        return 'ok', reassembleSMS(records)
+
+    def sendSMS(self, number, text):
+        #Long or non GSM texts are sent as correctly linked parts
+        with self.lock:
+            self.reference = (self.reference+1) % 256
+            ok = True
+            for pdu, length in encodeSMS(number, text, self.reference):
+                ok = ok and self.command('AT+CMGS='+str(length), 60, pdu.encode('ascii'))[0]
+            return ok
+
+class ProcessRegistry:
+    #Gammu children launched by the plugin, with their start time and timeout
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.children = {}
+        self.stopping = False
+
+    def run(self, args, timeout, stdin=None):
+        #Run one child to completion, killed if it exceeds its timeout. Returns (returncode, output)
+        if self.stopping:
+            return -1, 'Error: plugin stopping'
+        proc = subprocess.Popen(args, stdin=subprocess.PIPE if stdin is not None else None, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        with self.lock:
+            self.children[proc.pid] = [proc, args[len(gammu_cmd)] if len(args) > len(gammu_cmd) else args[0], time.time(), timeout]
+            if self.stopping:
+                proc.kill()
+        try:
+            out = proc.communicate(stdin, timeout=timeout)[0]
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            try:
+                out = proc.communicate(timeout=5)[0]+'\nError: timeout after '+str(timeout)+'s'
+            except subprocess.TimeoutExpired:
+                #Not reaped : left in the registry, reported by hung()
+                return -1, 'Error: timeout after '+str(timeout)+'s'
+        with self.lock:
+            self.children.pop(proc.pid, None)
+        return proc.returncode, out
+
+    def hung(self):
+        #[(pid, name, running time)] of the children running past their timeout
+        now = time.time()
+        with self.lock:
+            return [(pid, child[1], now-child[2]) for pid, child in self.children.items() if now-child[2] > child[3]]
+
+    def killAll(self):
+        with self.lock:
+            for pid, child in self.children.items():
+                try:
+                    child[0].kill()
+                except Exception:
+                    pass
+            self.children = {}
+
+    def stop(self):
+        #No new child from now on, the running ones are killed
+        self.stopping = True
+        self.killAll()
+
+class CliSession:
+    #Fallback : one gammu process per call, AT commands through a short-lived pyserial handle
+    persistent = False
+    ready = False
+    push = False
+    def __init__(self, port, baudrate, section=0):
+        self.port = port
+        self.baudrate = baudrate
+        #gammu -s N : [gammuN] section of the config file for the additional modems
+        self.cmd = gammu_cmd+(['-s', str(section)] if section > 0 else [])
+        self.ser = None
+        #Our own gammu calls are serialized, they would collide on the UART
+        self.lock = threading.RLock()
+        self.processes = ProcessRegistry()
+
+    def gammu(self, args):
+        with self.lock:
+            out = self.processes.run(self.cmd+args, gammu_timeouts.get(args[0], gammu_timeout))[1]
+        if 'Error opening device.' in out:
+            timings.count('device_busy')
+        return out
+
+    def open(self):
+        try:
+            self.ser = serial.Serial(port=self.port, baudrate=self.baudrate, timeout=at_read_timeout)
+        except Exception as e:
+            #Missing port (unplugged module, typo)
+            self.ser = None
+            self.ready = False
+            return False
+        self.ser.close()
+        #test AT
+        retry = 10
+        while retry>0:
+            if self.command('AT', 1)[0]:
+                break
+            retry-=1
+        #Set the jamming detection option
+        self.command('AT+SJDR=1,0,255')
+        self.ready = retry > 0
+        return self.ready
+
+    def close(self):
+        self.processes.killAll()
+        if self.ser is not None:
+            self.ser.close()
+
+    def stop(self):
+        #From onStop, without the session lock : kills the gammu call in progress and refuses the next ones
+        self.processes.stop()
+
+    def resetLink(self):
+        #Recovery tier 1 : drop our gammu children and check the UART still answers
+        self.processes.killAll()
+        return self.command('AT', 1)[0]
+
+    def reopen(self):
+        #Recovery tier 2 : reopen the session (AT test and jamming option)
+        if self.processes.stopping:
+            return False
+        self.close()
+        return self.open()
+
+    def command(self, cmd, timeout=5):
+        #The port is only held for the duration of the command, gammu needs it in between
+        with self.lock:
+            if self.processes.stopping:
+                return False, []
+            try:
+                self.ser.open()
+            except Exception as e:
+                return False, ['Error: '+str(e)]
+            try:
+                return ATChannel(self.ser).command(cmd, timeout)
+            finally:
+                self.ser.close()
+
+    def at(self, cmd):
+        return self.command(cmd)[1]
+
+    def pollUnsolicited(self):
+        #The UART is not held open between calls : no push mode
+        return []
+
+    def enterPin(self, pin):
+        #Cheap status query first, the PIN is only entered when the SIM waits for it
+        if "Nothing to enter." in self.gammu(['getsecuritystatus']):
+            return 'none'
+        pin_status = self.gammu(['entersecuritycode', 'PIN', pin])
+        if "Nothing to enter." in pin_status:
+            return 'none'
+        elif "Security error" in pin_status:
+            return 'error'
+        return 'ok'
+
+    def identify(self):
+        gsm_info = self.gammu(['identify'])
+        return [[info.split(' : ')[0].strip(), info.split(' : ')[1].strip()] for info in gsm_info.split('\n') if " : " in info]
+
+    def networkInfo(self):
+        return self.gammu(['networkinfo']).strip()
+
+    def signalQuality(self):
+        #Signal quality in %, None if unknown
+        level = re.search(r'Network level\s*:\s*(\d+) percent', self.gammu(['getsignalquality']))
+        return int(level.group(1)) if level else None
+
+    def getAllSMS(self):
+        sms = self.gammu(['getallsms']).strip()
+        if 'Error opening device.' in sms:
+            return 'busy', []
+        return 'ok', reassembleSMS(parseGammuSMS(sms))
+
+    def deleteSMS(self, locations):
+        #One gammu batch session for all the deletions, returns the deleted locations
+        if len(locations) == 0:
+            return []
+        commands = ''.join('deletesms 1 '+str(loc)+'\n' for loc in locations)
+        with self.lock:
+            returncode, out = self.processes.run(self.cmd+['batch'], gammu_timeout, commands)
+        return list(locations) if returncode == 0 else []
+
+    def sendSMS(self, number, text):
+        with self.lock:
+            #-len : longer texts are split by gammu into linked SMS
+            args = ['sendsms', 'TEXT', number, '-len', str(len(text)), '-text', text]
+            if gsmSeptets(text) is None:
+                args.append('-unicode')
+            return self.processes.run(self.cmd+args, gammu_timeouts['sendsms'])[0] == 0
+
+def openSession(port, baudrate, section=0, fallback=True, log=None):
+    #Open the configured modem session, falls back to the gammu CLI if the AT channel cannot be opened.
+    #Without fallback a failed AT session is returned as is (not ready), the recoveries open it again later
+    if session_backend == 'serial':
+        session = ATSession(port, baudrate)
+        if session.open():
+            return session
+        session.close()
+        if not fallback:
+            return session
+        (log or Domoticz.Log)("Can't open the AT session on "+port+" --> fallback to the gammu CLI")
+    session = CliSession(port, baudrate, section)
+    session.open()
+    return session
+
+#Additional modems : their devices use the units of the first modem + n*modem_unit_offset (n = 1, 2...)
+modem_unit_offset=10
+#Devices of each modem : unit, name, type, DeviceID, options
+modem_devices=[(uid_GSMinfo, "GSM Info", "Text", "gsm_info", None),
+               (uid_SMS, "Received SMS", "Text", "gsm_receivedsms", None),
+               (uid_jamming, "GSM Jamming", "Alert", "gsm_jamming", None),
+               (uid_netstat, "GSM Network Status", "Alert", "gsm_attached", None),
+               (uid_signal, "GSM Signal", "Percentage", "gsm_signal", None),
+               (uid_cellid, "GSM Cell ID", "Custom", "gsm_cellid", {"Custom": "1;"})]
+#Network states in which a modem is used to send SMS
+registered_states=frozenset(['home network', 'roaming network'])
+
+def parseExtraPorts(field, pin):
+    #Additional modems from the 'Port' field : [(port, pin)] and the ignored entries. Domoticz handles this field
+    #as the TCP port of the hardware, so it may hold '0' or a number : only device paths are taken
+    ports = []
+    ignored = []
+    for extra in str(field).split(','):
+        extra = extra.strip()
+        if extra == '' or extra == '0':
+            continue
+        port, sep, own_pin = extra.partition(':')
+        if port.startswith('/') or re.match(r'COM\d+$', port):
+            ports.append((port, own_pin if sep else pin))
+        else:
+            ignored.append(extra)
+    return ports, ignored
+
+class Modem:
+    #One GSM module : session, job schedule, devices and health (registered, not jammed) used by the SMS senders
+    def __init__(self, index, port, pin):
+        self.index = index
+        self.port = port
+        self.pin = pin
+        self.suffix = '' if index == 0 else '_'+str(index+1)
+        self.label = 'GSM' if index == 0 else 'GSM '+str(index+1)
+        self.session = None
+        self.scheduler = Scheduler(schedule_jobs)
+        self.identity = None
+        self.incomplete = {}
+        self.recovery_level = 0
+        self.registered = True
+        self.jammed = False
+        self.sent_times = collections.deque()
+
+    def unit(self, uid):
+        return uid+self.index*modem_unit_offset
+
+    def healthy(self):
+        return self.session is not None and self.session.ready and self.registered and not self.jammed
+
+def setGammuSection(config_file, section, values):
+    #Set the [(key, value)] in one [section] of the gammu config, the section is added if missing
+    match = re.search(r'(?ms)^\[%s\][^\n]*\n(.*?)(?=^\[|\Z)' % re.escape(section), config_file)
+    if match is None:
+        return config_file.rstrip('\n')+'\n\n['+section+']\n'+''.join(key+' = '+value+'\n' for key, value in values)
+    body = match.group(1)
+    for key, value in values:
+        #Blanks only around '=' : an empty value must not pull in the next line
+        body, n = re.subn(r'(?m)^(%s[ \t]*=[ \t]*).*$' % re.escape(key), lambda m: m.group(1)+value, body)
+        if n == 0:
+            body = key+' = '+value+'\n'+body
+    return config_file[:match.start(1)]+body+config_file[match.end(1):]
 
 class BasePlugin:
     enabled = False
+    workers = []
+    modems = []
+    recovery_full = 0
+    recoveries = None
+    api = None
+    outbox = None
+    router = None
     def onStart(self):
         #Get the variables
         self.debugging = Parameters["Mode6"].strip()
@@ -132,6 +1436,30 @@ class BasePlugin:
         self.port = Parameters["SerialPort"].strip()
         self.passkey = unidecode(Parameters["Mode4"].strip().replace(" ", "").lower())
         self.name_idx = unidecode(str(Parameters["Mode5"]).strip().replace(" ", "").lower())
+        self.commands = buildCommandIndex(self.name_idx)
+        #One Modem per UART port : the main one, then the additional ones ('port' or 'port:pin')
+        self.modems = [Modem(0, self.port, self.pin)]
+        extra_ports, ignored = parseExtraPorts(Parameters.get("Port", ""), self.pin)
+        for port, pin in extra_ports:
+            self.modems.append(Modem(len(self.modems), port, pin))
+        if len(ignored) > 0:
+            Domoticz.Log("Additional GSM modules: "+', '.join(ignored)+" ignored (not a device path)")
+        #Kept across a full recovery so that buffered notifications are not lost
+        if self.router is None:
+            self.router = NotificationRouter(self.auth_phones)
+        self.api = DomoticzAPI(dz_url)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=command_workers)
+        self.results = queue.Queue()
+        self.plugin_thread = threading.current_thread()
+        if self.recoveries is None:
+            self.recoveries = collections.deque(maxlen=recovery_history)
+        self.stats_count = 0
+        self.jobs = {'sms':self.pollSMS, 'jamming':self.pollJamming, 'network':self.pollNetwork, 'identify':self.pollIdentify}
+        #Last values written to the devices, telemetry is only written on change
+        self.device_values = dict((unit, (Devices[unit].nValue, Devices[unit].sValue)) for unit in Devices)
+        self.journal = SMSJournal(os.path.join(Parameters["HomeFolder"], 'sms_journal.json'))
+        self.cache = StartupCache(os.path.join(Parameters["HomeFolder"], startup_cache_file), startupKey(session_backend, ','.join(modem.port for modem in self.modems), self.baudrate, gammu_config))
+        start_time = time.time()
 
         #HARDCODED
         if self.debugging == "true":
@@ -139,102 +1467,149 @@ class BasePlugin:
         DumpConfigToLog()
         #Debug data values
         #HEartbeat 
-        Domoticz.Heartbeat(20)
+        Domoticz.Heartbeat(heartbeat_interval)
         Domoticz.Notifier("OnBoard_GSM")
         #ReConfigure the config.json 
         success = self.reWriteConfigFile()
         if not success:
             Domoticz.Log("Reconfigure .gammurc --> Failed")
             return 0
-        #Create Variables and Devices
-        if len(Devices) == 0:
-            #SMS LOG Variable 
-            Domoticz.Device(Name="GSM Info", TypeName="Text", Unit=uid_GSMinfo, DeviceID="gsm_info").Create()
-            Domoticz.Device(Name="Received SMS", TypeName="Text", Unit=uid_SMS, DeviceID="gsm_receivedsms").Create()
-            #Domoticz.Device(Name="GSM Network Status", TypeName="Text", Unit=uid_netstat, DeviceID="gsm_attached").Create()
-            Domoticz.Device(Name="GSM Jamming", TypeName="Alert", Unit=uid_jamming, DeviceID="gsm_jamming").Create()
-        #PinCode if set 
-        if self.pin != "":
-            pin_status = os.popen('/usr/bin/gammu --config /home/pi/.gammurc entersecuritycode PIN '+self.pin).read()
-            if "Nothing to enter." in pin_status:
-                Domoticz.Log("No Pin Code required !")
-            elif "Security error":
-                Domoticz.Log("Error PIN Code ! Please check in a phone (locked after 3 attempts")
-                return
-        #Get GSM Infos and put them into variables 
-        gsm_info = os.popen('/usr/bin/gammu --config /home/pi/.gammurc identify').read()
-        Domoticz.Debug("GSM Module information --> update into variables")
-        for info in gsm_info.split('\n'):
-            if " : " in info:
-                var_name = "GSM_"+info.split(' : ')[0].strip()
-                var_val = info.split(' : ')[1].strip()
-                r = requests.get('http://127.0.0.1:8080/json.htm?type=command&param=adduservariable&vname='+var_name+'&vtype=2&vvalue='+var_val)
-                r = requests.get('http://127.0.0.1:8080/json.htm?type=command&param=updateuservariable&vname='+var_name+'&vtype=2&vvalue='+var_val)
-                
-        time.sleep(0.5)  
-        # global SerialConn
-        global ser
-        ser = serial.Serial(port=self.port,baudrate=int(self.baudrate.split('at')[1]),timeout=1)
-        # ser = serial.Serial(port = '/dev/ttyUSB_ttyS1',baudrate=19200,timeout=1)
-        try: 
-            ser.open()
-            # SerialConn = Domoticz.Connection(Name="tty_GSM", Transport="Serial", Protocol="None", Address=self.port, Baud=int(self.baudrate))
-            # SerialConn.Connect()
-            # SerialConn.Send(b'AT+SJDR=1,0,255\r')
-        except Exception as e:
-            Domoticz.Debug( "Can't open serial port: " + str(e))
-        #test AT
-        retry = 10
-        while retry>0:
-            ser.write(b'AT\r')
-            if 'OK' in str(ser.readlines()):
-                break
-            retry-=1
-        if retry == 0:
-            os.system('sudo python /home/pi/domoticz/scripts/python/i2c_actions.py 2')
-
-        #Set the jamming detection option
-        ser.write(b'AT+SJDR=1,0,255\r')
-        ser.close()
-        
+        self.createDevices()
+        #Open the modem sessions, reused for every later modem access
+        network_infos = {}
+        for modem in list(self.modems):
+            try:
+                network_info = self.startModem(modem)
+            except Exception as e:
+                Domoticz.Error(modem.label+" on "+modem.port+": "+str(e))
+                network_info = None
+            if network_info is None:
+                #Left out, like a SIM refusing the PIN : the other modems start anyway
+                if modem.session is not None:
+                    modem.session.close()
+                    modem.session = None
+                self.modems.remove(modem)
+            else:
+                network_infos[modem.index] = network_info
+        if len(self.modems) == 0:
+            return
         #Check that everything is running fine
-        network_info = os.popen('/usr/bin/gammu --config /home/pi/.gammurc networkinfo').read()
-        if "Warning" in network_info or "Error" in network_info :
-            success = 0
-            
-        if success == 1:
+        failed = [modem for modem in self.modems if "Warning" in network_infos[modem.index] or "Error" in network_infos[modem.index]]
+        if len(failed) == 0:
             #remove the backup file
-            os.system("sudo rm "+self.backupfile)
+            if self.backupfile is not None:
+                os.system("sudo rm "+self.backupfile)
         else:
-            Domoticz.Log("Trying to revert the config file...")
-            copy2(self.backupfile,"/home/pi/.gammurc")
-            success = self.startProcess()
+            if self.backupfile is not None:
+                Domoticz.Log("Trying to revert the config file...")
+                copy2(self.backupfile,gammu_config)
+            for modem in failed:
+                modem.session.close()
+                modem.session = openSession(modem.port, int(self.baudrate.split('at')[1]), modem.index)
+                modem.scheduler.setInterval('sms', sms_sweep_interval if modem.session.push else schedule_jobs['sms'][0])
         #Update the ID
-        if success:
-            #update the network info
-            Devices[uid_GSMinfo].Update(sValue=str(network_info), nValue=0)
-            # Devices["gsm_info"].Update(sValue=str(network_info), nValue=0)
+        for modem in self.modems:
+            if modem not in failed:
+                #update the network info
+                self.updateDevice(modem.unit(uid_GSMinfo), 0, str(network_infos[modem.index]))
+                modem.registered = parseNetworkInfo(network_infos[modem.index]).get('Network state') in registered_states
+        #Outbound SMS are sent by every modem
+        self.outbox = SMSOutbox(self.modems, self.emit)
+        self.outbox.start()
+        #Start the background modem workers, one per modem
+        if use_worker:
+            self.workers = [ModemWorker(self, modem) for modem in self.modems]
+            for worker in self.workers:
+                worker.start()
+        timings.add('start', time.time()-start_time)
+
+    def createDevices(self):
+        #Create Variables and Devices : one set per modem
+        for modem in self.modems:
+            for uid, name, type_name, device_id, options in modem_devices:
+                if modem.unit(uid) not in Devices:
+                    extra = {} if options is None else {'Options':options}
+                    Domoticz.Device(Name=name+('' if modem.index == 0 else ' '+str(modem.index+1)), TypeName=type_name, Unit=modem.unit(uid), DeviceID=device_id+modem.suffix, **extra).Create()
+        if uid_polltime not in Devices:
+            Domoticz.Device(Name="GSM Poll time", TypeName="Custom", Options={"Custom": "1;ms"}, Unit=uid_polltime, DeviceID="gsm_polltime").Create()
+        if uid_stats not in Devices:
+            Domoticz.Device(Name="GSM Stats", TypeName="Text", Unit=uid_stats, DeviceID="gsm_stats").Create()
+
+    def startModem(self, modem, recovery=False):
+        #Session, PIN and identity of one modem. Returns its network info, None if the SIM refused the PIN or
+        #if an additional modem cannot be opened at start. Also run by the full recovery on the worker of the
+        #modem : Domoticz is only reached through emit
+        with timings.stage('start_session'):
+            modem.session = openSession(modem.port, int(self.baudrate.split('at')[1]), modem.index, not recovery, lambda text: self.emit('log', text))
+        if not modem.session.ready and modem.index == 0:
+            os.system('sudo python '+reset_script+' 2')
+        elif not modem.session.ready and not recovery:
+            #An additional module that cannot be opened at start is left out
+            self.emit('log', modem.label+": can't open "+modem.port+" --> not used")
+            modem.session.close()
+            return None
+        modem.scheduler.setInterval('sms', sms_sweep_interval if modem.session.push else schedule_jobs['sms'][0])
+        #PinCode if set 
+        if modem.pin != "":
+            pin_status = modem.session.enterPin(modem.pin)
+            if pin_status == 'none':
+                self.emit('log', modem.label+": No Pin Code required !")
+            elif pin_status == 'error':
+                self.emit('log', modem.label+": Error PIN Code ! Please check in a phone (locked after 3 attempts")
+                modem.session.close()
+                return None
+        #Get GSM Infos and put them into variables : static data, not fetched again by a recovery
+        #nor by a restart with the same config (the identify job checks it again in the background)
+        modem.identity = self.cache.get('identity'+modem.suffix)
+        if modem.identity is None:
+            with timings.stage('start_identify'):
+                gsm_info = modem.session.identify()
+            modem.identity = gsm_info
+            self.cache.set('identity'+modem.suffix, gsm_info)
+            modem.scheduler.done('identify', time.time())
+            self.emit('debug', modem.label+" module information --> update into variables")
+            self.pushIdentity(modem, gsm_info)
+        else:
+            self.emit('debug', modem.label+" module information from the startup cache")
+        with timings.stage('start_networkinfo'):
+            return modem.session.networkInfo()
+
+    def pushIdentity(self, modem, gsm_info):
+        #Only the variables whose value changed since the last push
+        pushed = self.cache.get('variables', {})
+        for info in gsm_info:
+            var_name = "GSM"+modem.suffix+"_"+info[0]
+            var_val = info[1]
+            if pushed.get(var_name) == var_val:
+                continue
+            try:
+                self.api.setUserVariable(var_name, var_val)
+                pushed[var_name] = var_val
+            except requests.RequestException as e:
+                self.emit('log', "Can't update variable "+var_name+": "+str(e))
+        self.cache.set('variables', pushed)
 
     def reWriteConfigFile(self):
-        #backup file 
-        file = "/home/pi/.gammurc"
-        backup = "/home/pi/.gammurc.bakDZ."+self.dt
-        self.backupfile=backup
-        copy2(file,backup)
+        file = gammu_config
         #open file 
         f= open(file,"r+")
         config_file = f.read()
         f.close()
+        current_file = config_file
         # Domoticz.Debug(str(config_file))
-        #Re parameter
-        end_look="\n"
-        parameter=[["connection = ",self.baudrate],\
-                    ["port = ",self.port]]
-        for param in parameter:
-            reg = "(?<=%s).*?(?=%s)" % (param[0],end_look)
-            r = re.compile(reg,re.DOTALL)
-            config_file = r.sub(param[1], config_file)
+        #Re parameter : [gammu] for the first modem, [gammuN] for the additional ones (gammu -s N)
+        for modem in self.modems:
+            section = 'gammu'+('' if modem.index == 0 else str(modem.index))
+            config_file = setGammuSection(config_file, section, [['connection', self.baudrate], ['port', modem.port]])
 
+        #Nothing to change : no backup, no write
+        if config_file == current_file:
+            self.backupfile = None
+            return 1
+        #backup file 
+        backup = gammu_config+".bakDZ."+self.dt
+        self.backupfile=backup
+        copy2(file,backup)
         #Save the new file 
         f = open(file, "w+")
         f.write(config_file)
@@ -243,13 +1618,41 @@ class BasePlugin:
 
     
     def onStop(self):
-        Domoticz.Log("Killing GAMMU process")
-        os.system("sudo killall gammu")
-        time.sleep(2)
+        #Signal every thread, then interrupt the modem accesses in progress (a send, a gammu call) so that
+        #the joins are short. The threads still running after stop_timeout are reported
+        threads = list(self.workers)
+        if len(self.workers) > 0:
+            Domoticz.Log("Stopping modem workers")
+            for worker in self.workers:
+                worker.stop()
+        if self.outbox is not None:
+            self.outbox.stop()
+            threads.extend(self.outbox.senders)
+        for modem in self.modems:
+            if modem.session is not None:
+                modem.session.stop()
+        deadline = time.time()+stop_timeout
+        for thread in threads:
+            thread.join(max(0, deadline-time.time()))
+        alive = [thread.name for thread in threads if thread.is_alive()]
+        if len(alive) > 0:
+            Domoticz.Error("Still running after "+str(stop_timeout)+"s: "+', '.join(alive))
+        self.workers = []
+        self.outbox = None
+        if self.api is not None:
+            self.executor.shutdown(wait=False)
+            self.api.close()
+        for modem in self.modems:
+            if modem.session is not None:
+                #Only the gammu processes launched by the plugin are killed. A thread still running may hold
+                #the session lock : its port is already closed by stop()
+                if len(alive) == 0:
+                    modem.session.close()
+                modem.session = None
+        self.modems = []
 
     def onConnect(self, Connection, Status, Description):
         Domoticz.Debug("onConnect called")
-        global ser
         # global SerialConn
         # if (Status == 0):
         #     Domoticz.Log("Connected successfully to GSM on "+Parameters["SerialPort"])
@@ -268,179 +1671,372 @@ class BasePlugin:
 
     def onNotification(self, Name, Subject, Text, Status, Priority, Sound, ImageFile):
         Domoticz.Debug("Notification: " + Name + "," + Subject + "," + Text + "," + Status + "," + str(Priority) + "," + Sound + "," + ImageFile)
-        #Notification based on priority. Prioriy High will be sent by SMS to the 1st user in list. Priority Emergency will be sent to everyone. 
-        for phs in self.auth_phones.split(','):
-            if Priority > 0:
-                #Send to every mobile phone in the list 
-                Domoticz.Log('Notification sent to '+phs)
-                os.system('sudo nohup /home/pi/domoticz/scripts/bash/send_sms.sh '+phs+' "Domoticz.'+Name+'" "'+Subject+'" &')
-                if not (Priority>1):
-                    return
+        #Notification based on priority (notify_routes). Prioriy High will be sent by SMS to the 1st user in list. Priority Emergency will be sent to everyone. 
+        if self.router.notify(Priority, 'Domoticz.'+Name+' '+Subject, time.time()) > 0:
+            self.flushNotifications()
+
+    def flushNotifications(self):
+        if self.outbox is None:
+            return
+        for number, text in self.router.flush(time.time()):
+            Domoticz.Log('Notification queued for '+number)
+            self.outbox.send(number, text)
 
     def onDisconnect(self, Connection):
         Domoticz.Debug("onDisconnect called")
 
     def onHeartbeat(self):
-        # global hasConnected, SerialConn
-        global ser
-        PID = "NO PROCESS"
-        #Check if a GAMMU process is running, delay 1, if still running probleme, stop and restart 
-        i=0
-        while i < 17:
-            for proc in psutil.process_iter(['pid', 'name', 'username']):
-                if proc.info['name']=='gammu':
-                    PID = str(proc.info['pid'])
-            if PID == "NO PROCESS":
+        with timings.stage('heartbeat'):
+            self.drainResults()
+            self.flushNotifications()
+            if not use_worker:
+                for modem in self.modems:
+                    self.runCycle(modem)
+            for i, worker in enumerate(self.workers):
+                if not worker.is_alive():
+                    #Worker mode : only apply what the workers produced, never wait for a modem here
+                    Domoticz.Log(worker.modem.label+" worker stopped, starting a new one")
+                    self.workers[i] = ModemWorker(self, worker.modem)
+                    self.workers[i].start()
+        self.stats_count += 1
+        if self.stats_count >= stats_heartbeats:
+            self.stats_count = 0
+            self.updateStats()
+
+    def updateStats(self):
+        if uid_stats not in Devices:
+            return
+        report = timings.report()
+        Devices[uid_polltime].Update(nValue=0, sValue=str(timings.percentiles('poll')[1]))
+        Devices[uid_stats].Update(nValue=0, sValue=report)
+        if self.debugging == "true":
+            for line in report.split('\n'):
+                Domoticz.Log('Stats '+line)
+
+    def emit(self, kind, *args):
+        #Domoticz API must only be called from the plugin thread : the other threads queue their results
+        if threading.current_thread() is not self.plugin_thread:
+            self.results.put((kind,) + args)
+        else:
+            self.applyResult((kind,) + args)
+
+    def drainResults(self):
+        while True:
+            try:
+                result = self.results.get_nowait()
+            except queue.Empty:
                 break
-            i += 1
-            time.sleep(1)
-
-        if PID != "NO PROCESS":
-            Domoticz.Log("Gammu seems stuck, restarting !")
-            self.onStop()
-            time.sleep(2)
-            self.onStart()
+            self.applyResult(result)
+
+    def applyResult(self, result):
+        kind = result[0]
+        if kind == 'log':
+            Domoticz.Log(result[1])
+        elif kind == 'debug':
+            Domoticz.Debug(result[1])
+        elif kind == 'update':
+            #('update', unit, nValue, sValue)
+            Devices[result[1]].Update(nValue=result[2], sValue=result[3])
+        elif kind == 'devices':
+            #Devices deleted meanwhile are created again by a full recovery
+            self.createDevices()
+
+    def runCycle(self, modem):
+        #Due jobs of one modem by priority, then its +CMTI indications
+        if modem.session is None:
+            return
+        if not modem.session.persistent:
+            #A gammu child that could not be killed at its timeout : recover
+            hung = modem.session.processes.hung()
+            if len(hung) > 0:
+                for pid, name, running in hung:
+                    self.emit('log', "Gammu "+name+" (PID "+str(pid)+") stuck for "+str(int(running))+"s, recovering !")
+                self.recover(modem)
+                return
+        names = modem.scheduler.due(time.time())
+        if len(names) > 0:
+            with timings.stage('poll'):
+                for name in names:
+                    try:
+                        self.jobs[name](modem)
+                    finally:
+                        modem.scheduler.done(name, time.time())
+        self.checkIndications(modem)
+
+    def pollJamming(self, modem):
+        with timings.stage('jamming'):
+            jam_lines = modem.session.at('AT+SJDR?')
+        for a in jam_lines:
+            if '+SJDR:' in a and len(a)>10:
+                jamming=a.split(',')[4].split('\r')[0]
+                jam_level = 0#domoticz alert level 
+                jam_text = "No jamming"#domoticz alert level 
+                if '2' in jamming:
+                    jam_level=3
+                    jam_text = "Interferences detected"
+                if '1' in jamming:
+                    jam_level=4
+                    jam_text = "Alert jamming !"
+                self.updateDevice(modem.unit(uid_jamming), jam_level, jam_text)
+                self.setHealth(modem, jammed=(jam_level == 4))
+
+    def pollNetwork(self, modem):
+        self.emit('debug', modem.label+' Network Info')
+        with timings.stage('networkinfo'):
+            network_info = modem.session.networkInfo()
+        self.emit('debug', str(network_info))
+        if "Warning" in network_info or "Error" in network_info :
+            self.emit('debug', '--> Error with Gammu')
+            self.updateDevice(modem.unit(uid_GSMinfo), 0, "Error with Gammu")
+            self.setHealth(modem, registered=False)
+            modem.scheduler.busy()
+            self.recover(modem)
         else:
-            #Jamming 
-            # if (SerialConn.Connected()):
-            #     SerialConn.Send(b'AT+SJDR?\r')
-            # else:
-            #     hasConnected = False
-            #     SerialConn.Connect()
-            try: 
-                ser.open()
-            except Exception as e:
-                Domoticz.Debug( "error open serial port: " + str(e))
-            ser.write(b'AT+SJDR?\r')
-            a=ser.readline().strip().decode('ascii')
-            while a != '':
-                if '+SJDR:' in a and len(a)>10:
-                    jamming=a.split(',')[4].split('\r')[0]
-                    jam_level = 0#domoticz alert level 
-                    jam_text = "No jamming"#domoticz alert level 
-                    if '2' in jamming:
-                        jam_level=3
-                        jam_text = "Interferences detected"
-                    if '1' in jamming:
-                        jam_level=4
-                        jam_text = "Alert jamming !"
-                    Devices[uid_jamming].Update(sValue=jam_text, nValue=jam_level)
-
-                a=ser.readline().strip().decode('ascii')
-            ser.close()
-            #Network INFO [WIP] --> Add network status clearly
-            Domoticz.Debug('Network Info')
-            network_info = os.popen('/usr/bin/gammu --config /home/pi/.gammurc networkinfo').read().strip()
-            Domoticz.Debug(str(network_info))
-            if "Warning" in network_info or "Error" in network_info :
-                Domoticz.Debug('--> Error with Gammu')
-                Devices[uid_GSMinfo].Update(sValue="Error with Gammu", nValue=0)
-            else:
-                Devices[uid_GSMinfo].Update(sValue=str(network_info), nValue=0)
-                #Devices[uid_netstat].Update(sValue=str(network_info.split('GPRS                 : ')[1].split('\n')[0]), nValue=0)
-            
-            #Get SMS
-            sms = os.popen('/usr/bin/gammu --config /home/pi/.gammurc getallsms').read().strip()
-            message_number = 0
-            if '0 SMS parts in 0 SMS sequences' in sms:
-                Domoticz.Debug('Pas de message reçu')
-            elif 'Error opening device.' in sms:
-                Domoticz.Log('GSM device is busy --> retry next heartbeat')
-            else:
-                Domoticz.Log('Message reçu')
-                new_message=True
-                while new_message:
-                    if 'Location' in sms:
-                        message_number += 1
-                        #split inot parts 
-                        sms_parts = sms.split('\n')
-                        #Gather elements
-                        sms_date = sms_parts[3].split('Sent                 : ')[1].split(' +')[0]
-                        sms_sender = sms_parts[5].split('Remote number        : "')[1].split('"')[0]
-                        sms_cmd_raw = sms_parts[8]
-                        sms_display = sms_date + '('+sms_sender+'):\n'+sms_cmd_raw
-                        Devices[uid_SMS].Update(sValue=sms_display, nValue=0)
-                        Domoticz.Log(sms_display)
-                        #process message command 
-                        if sms_sender in self.auth_phones.split(','):
-                            sms_condensed = unidecode(str(sms_cmd_raw).strip().replace(" ", "").lower())
-                            if self.passkey in sms_condensed:
-                                Domoticz.Log('Proceed Command ')
-                                if 'restart' in sms_condensed:
-                                    Domoticz.Log("System will reboot in 5 seconds")
-                                    #SEND SMS .py
-                                    #TODO
-                                    os.system('sudo /home/pi/domoticz/scripts/bash/send_sms.sh '+sms_sender+' "Reboot now"')
-                                    #
-                                    time.sleep(1)
-                                    r = requests.get('http://127.0.0.1:8080/json.htm?type=command&param=system_reboot')
-                                answer = ''
-                                sms_cmd_list = sms_condensed.split(str(self.passkey))[1].split('\n')
-                                for sms_cmd in sms_cmd_list:
-                                    #Look for known commands
-                                    for n_idx in self.name_idx.split(','):
-                                        #Check if Key is in the SMS
-                                        key = str(n_idx.split(':')[0])
-                                        key_idx=str(n_idx.split(':')[1])
-                                        if key in sms_cmd:
-                                            #Check if there is a command, or it is just a query for state
-                                            if len(sms_cmd.split(key)) > 1 and sms_cmd.split(key)[1] != '':#['cmd', 'on']--> len()=2 or ['cmd','']
-                                                #Associate command with Domoticz Command
-                                                d_command=sms_cmd.split(key)[1].split('\n')[0]
-                                                device_command=''
-                                                if d_command in list_switch_On:
-                                                    device_command='On'
-                                                elif d_command in list_switch_Off:
-                                                    device_command='Off'
-                                                elif d_command in list_switch_Toggle:
-                                                    device_command='Toggle'
-                                                else:
-                                                    #Dimmable LED
-                                                    device_command='Set%20Level&level='+d_command
-                                                #Set the command via HTTP API 
-                                                r = requests.get('http://127.0.0.1:8080/json.htm?type=command&param=switchlight&idx='+key_idx+'&switchcmd='+device_command)
-                                                if r.status_code == 200:
-                                                    answer += 'Ok, device '+key+'(IDX: '+key_idx+') was set to '+device_command
-                                                else:
-                                                    answer += 'Problem with command ! code '+str(r.status_code)+': '+str(r.text)
-
-                                            #Else just query the state 
-                                            else:
-                                                #Get the status of a specifi device via HTTP API 
-                                                r = requests.get('http://127.0.0.1:8080/json.htm?type=devices&rid='+key_idx)
-                                                if r.status_code == 200:
-                                                    #parse the answered JSON
-                                                    http_answ=json.loads(r.text)["result"][0]
-                                                    #Print answer
-                                                    answer += 'Device '+http_answ['Name']+' (IDX:'+http_answ['idx']+') is '+http_answ['Data']+' (last updated on '+http_answ['LastUpdate']+')'
-                                                else:
-                                                    answer += 'Problem with command ! code '+str(r.status_code)+': '+str(r.text)
-
-
-                                Domoticz.Log(answer)
-                                #SMS.py --> Answer 
-                                #Domoticz.Debug('sudo nohup /home/pi/domoticz/scripts/bash/send_sms.sh '+sms_sender+' "'+answer+'" &')
-                                #os.system('sudo nohup /home/pi/domoticz/scripts/bash/send_sms.sh '+sms_sender+' "'+answer+'" &')
-                                Domoticz.Debug('/usr/bin/gammu --config /home/pi/.gammurc sendsms TEXT '+sms_sender+' -text "'+answer+'"')
-                                os.system('/usr/bin/gammu --config /home/pi/.gammurc sendsms TEXT '+sms_sender+' -text "'+answer+'"')
-                                time.sleep(1)
-                            else:
-                                Domoticz.Log('Error: Code incorrect, check in hardware definition')
-                        else:
-                            Domoticz.Log('Error: Command received, but phone number not registered. Authorized phones are :')
-                            for phs in self.auth_phones.split(','):
-                                Domoticz.Log(str(phs))
-
-                        #End of first SMS. Implode and start again
-                        sms = "\n".join(sms_parts[10:])
-                    else:
-                        new_message = False
-                Domoticz.Log(str(message_number)+' messages processed')
-                #Delete all SMS
-                del_sms = os.popen('/usr/bin/gammu --config /home/pi/.gammurc deleteallsms 1').read().strip()
-                Domoticz.Log(str(del_sms))
-            # onMessage()
+            modem.recovery_level = 0
+            modem.scheduler.idle()
+            self.updateDevice(modem.unit(uid_GSMinfo), 0, str(network_info))
+            info = parseNetworkInfo(network_info)
+            self.setHealth(modem, registered=(info.get('Network state') in registered_states))
+            self.updateTelemetry(modem, info)
+
+    def setHealth(self, modem, **state):
+        #A modem jammed or not registered is skipped by the SMS senders while another one is usable
+        healthy = modem.healthy()
+        for name, value in state.items():
+            setattr(modem, name, value)
+        if modem.healthy() != healthy:
+            self.emit('log', modem.label+(' available again' if modem.healthy() else ' unavailable (not registered or jammed)')+' for outbound SMS')
+
+    def pollIdentify(self, modem):
+        #Static data : variables only pushed again if the module changed
+        with timings.stage('identify'):
+            gsm_info = modem.session.identify()
+        if len(gsm_info) > 0 and gsm_info != modem.identity:
+            modem.identity = gsm_info
+            self.cache.set('identity'+modem.suffix, gsm_info)
+            self.pushIdentity(modem, gsm_info)
+
+    def pollSMS(self, modem):
+        #With push mode this is only a slow safety sweep
+        with timings.stage('getallsms'):
+            status, messages = modem.session.getAllSMS()
+        if status == 'busy':
+            timings.count('busy')
+            modem.scheduler.busy()
+            self.emit('log', modem.label+' device is busy --> retry later')
+            return
+        modem.scheduler.idle()
+        if len(messages) == 0:
+            self.emit('debug', 'Pas de message reçu')
+        else:
+            self.emit('log', 'Message reçu')
+            self.processStoredSMS(modem, messages, True)
 
+    def processStoredSMS(self, modem, messages, sweep):
+        #Handle and delete the listed SMS. Incomplete multipart SMS stay on the SIM : a sweep counts them
+        #and processes them as they are after sms_incomplete_sweeps sweeps
+        handled = []
+        incomplete = {}
+        for sms in messages:
+            if sms.udh is not None and sms.udh[1] < sms.udh[2]:
+                #Wait for the missing parts
+                if not sweep:
+                    continue
+                key = (sms.sender, sms.udh[0])
+                incomplete[key] = modem.incomplete.get(key, 0)+1
+                if incomplete[key] < sms_incomplete_sweeps:
+                    continue
+                self.emit('log', 'Multipart SMS from '+sms.sender+' still incomplete ('+str(sms.udh[1])+'/'+str(sms.udh[2])+') --> processed as is')
+            self.handleSMS(modem, sms)
+            handled.append(sms)
+        if sweep:
+            modem.incomplete = incomplete
+        self.emit('log', str(len(handled))+' messages processed')
+        if len(handled) == 0:
+            return
+        #Delete only the handled SMS
+        with timings.stage('deletesms'):
+            deleted = set(modem.session.deleteSMS([loc for sms in handled for loc in sms.locations]))
+        self.journal.forget([sms for sms in handled if set(sms.locations) <= deleted])
+        self.emit('log', str(len(deleted))+' SMS deleted')
+
+    def updateTelemetry(self, modem, info):
+        #Registration state and operator, cell ID and signal quality as dedicated devices
+        state = info.get('Network state', 'unknown')
+        operator = info.get('Name in phone', info.get('Network', ''))
+        self.updateDevice(modem.unit(uid_netstat), network_levels.get(state, 4), state+(' - '+operator if operator else ''))
+        cid = info.get('CID', '')
+        if re.match(r'^[0-9A-Fa-f]+$', cid):
+            self.updateDevice(modem.unit(uid_cellid), 0, str(int(cid, 16)))
+        with timings.stage('signal'):
+            signal = modem.session.signalQuality()
+        if signal is not None:
+            self.updateDevice(modem.unit(uid_signal), 0, str(signal), signal_deadband)
+
+    def updateDevice(self, unit, nValue, sValue, deadband=None):
+        #Only write to Domoticz when the value changed, or moved by at least deadband
+        last = self.device_values.get(unit)
+        if last is not None and last[0] == nValue:
+            if last[1] == sValue:
+                return
+            if deadband is not None:
+                try:
+                    if abs(float(sValue)-float(last[1])) < deadband:
+                        return
+                except ValueError:
+                    pass
+        self.device_values[unit] = (nValue, sValue)
+        self.emit('update', unit, nValue, sValue)
+
+    def recover(self, modem):
+        #Tiered recovery : serial link, then modem session, and only then a full reinitialization
+        tier = recovery_tiers[min(modem.recovery_level, len(recovery_tiers)-1)]
+        modem.recovery_level += 1
+        if tier == 'full':
+            if time.time()-self.recovery_full < recovery_full_interval:
+                self.emit('debug', 'Recovery: full reinitialization already done recently --> wait')
+                return
+            self.recovery_full = time.time()
+            self.emit('log', 'Recovery: full reinitialization of '+modem.label)
+            start = time.time()
+            ok = self.reinitialize(modem)
+            self.recordRecovery(tier, ok, start, modem)
+            if not ok:
+                #The cheaper tiers try again until the next full one is allowed
+                modem.recovery_level = 0
+            return
+        start = time.time()
+        if tier == 'serial':
+            ok = modem.session.resetLink()
+        else:
+            ok = modem.session.reopen()
+        self.recordRecovery(tier, ok, start, modem)
+
+    def reinitialize(self, modem):
+        #Full recovery tier, on the worker of the modem : new session, PIN and network check of this modem.
+        #The gammu config only depends on the parameters, it was already written by onStart. A serial
+        #backend never falls back to the gammu CLI here, so that push mode comes back with the module
+        self.emit('devices')
+        if modem.session is not None:
+            modem.session.close()
+        network_info = self.startModem(modem, recovery=True)
+        if network_info is None or not modem.session.ready or "Warning" in network_info or "Error" in network_info:
+            self.setHealth(modem, registered=False)
+            return False
+        self.updateDevice(modem.unit(uid_GSMinfo), 0, str(network_info))
+        self.setHealth(modem, registered=(parseNetworkInfo(network_info).get('Network state') in registered_states))
+        modem.recovery_level = 0
+        return True
+
+    def recordRecovery(self, tier, ok, start, modem=None):
+        duration = time.time()-start
+        self.recoveries.append((time.time(), tier, ok, duration))
+        self.emit('log', 'Recovery '+tier+('' if modem is None else ' of '+modem.label)+': '+('ok' if ok else 'failed')+' in '+str(round(duration, 1))+'s')
+
+    def checkIndications(self, modem):
+        #Push mode : read and process only the storage index given by +CMTI. A part of a concatenated SMS
+        #stays on the SIM until its sequence is complete
+        multipart = False
+        for line in modem.session.pollUnsolicited():
+            self.emit('debug', 'Unsolicited: '+line)
+            if line.startswith('+CMTI:'):
+                index = line.split(',')[-1].strip()
+                with timings.stage('readsms'):
+                    sms = modem.session.readSMS(index)
+                if sms is None:
+                    continue
+                if sms.udh is not None and sms.udh[2] > 1:
+                    multipart = True
+                    continue
+                self.handleSMS(modem, sms)
+                if len(modem.session.deleteSMS([index])) > 0:
+                    self.journal.forget([sms])
+        if multipart:
+            #Complete sequences only, the sweep takes care of those still missing parts
+            with timings.stage('getallsms'):
+                status, messages = modem.session.getAllSMS()
+            if status == 'ok':
+                self.processStoredSMS(modem, messages, False)
+
+    def handleSMS(self, modem, sms):
+        #Process a SMS once : the journal entry stays until the SMS is deleted from the SIM
+        if self.journal.isDone(sms):
+            self.emit('debug', 'SMS from '+sms.sender+' already processed --> delete only')
+            return
+        self.processSMS(modem, sms)
+        self.journal.markDone(sms)
+
+    def processSMS(self, modem, sms):
+        sms_date = sms.date
+        sms_sender = sms.sender
+        sms_cmd_raw = sms.text
+        sms_display = sms_date + '('+sms_sender+'):\n'+sms_cmd_raw
+        self.emit('update', modem.unit(uid_SMS), 0, sms_display)
+        self.emit('log', sms_display)
+        #process message command 
+        if sms_sender not in self.auth_phones.split(','):
+            self.emit('log', 'Error: Command received, but phone number not registered. Authorized phones are :')
+            for phs in self.auth_phones.split(','):
+                self.emit('log', str(phs))
+            return
+        sms_condensed = unidecode(str(sms_cmd_raw).strip().replace(" ", "").lower())
+        if self.passkey not in sms_condensed:
+            self.emit('log', 'Error: Code incorrect, check in hardware definition')
+            return
+        self.emit('log', 'Proceed Command ')
+        modem.scheduler.commandReceived(time.time())
+        if 'restart' in sms_condensed:
+            self.emit('log', "System will reboot in 5 seconds")
+            #Through the outbox like every reply, but the reboot waits for it to leave
+            self.outbox.wait(self.outbox.send(sms_sender, "Reboot now"), sms_restart_reply_timeout)
+            r = self.api.command('system_reboot')
+        #One command per line, or separated by '/' or ';'
+        sms_cmd_list = re.split(r'[\n/;]', sms_condensed.split(str(self.passkey))[1])
+        #Look for a known device name
+        actions = [match for match in (matchCommand(self.commands, sms_cmd) for sms_cmd in sms_cmd_list) if match is not None]
+        #The device actions run in parallel, the answers are kept in the order of the SMS
+        with timings.stage('actions'):
+            answers = list(self.executor.map(self.runAction, actions))
+        answer = '\n'.join(answers)
+        self.emit('log', answer)
+        if answer != '':
+            self.emit('debug', 'Answer to '+sms_sender+': "'+answer+'"')
+            self.outbox.send(sms_sender, answer)
+
+    def runAction(self, action):
+        key, key_idx, d_command = action
+        #Check if there is a command, or it is just a query for state
+        if d_command != '':
+            #Associate command with Domoticz Command
+            device_command=''
+            level=None
+            if d_command in list_switch_On:
+                device_command='On'
+            elif d_command in list_switch_Off:
+                device_command='Off'
+            elif d_command in list_switch_Toggle:
+                device_command='Toggle'
+            else:
+                #Dimmable LED
+                device_command='Set Level'
+                level=d_command
+            #Set the command via HTTP API 
+            try:
+                r = self.api.switchLight(key_idx, device_command, level)
+                if r.status_code == 200:
+                    return 'Ok, device '+key+'(IDX: '+key_idx+') was set to '+device_command+('' if level is None else ' '+level)
+                return 'Problem with command ! code '+str(r.status_code)+': '+str(r.text)
+            except requests.RequestException as e:
+                return 'Problem with command ! '+str(e)
+        #Else just query the state 
+        #Get the status of a specifi device from the cached device list
+        try:
+            http_answ = self.api.device(key_idx)
+            if http_answ is not None:
+                return 'Device '+http_answ['Name']+' (IDX:'+http_answ['idx']+') is '+http_answ['Data']+' (last updated on '+http_answ['LastUpdate']+')'
+            return 'Problem with command ! unknown IDX '+key_idx
+        except requests.RequestException as e:
+            return 'Problem with command ! '+str(e)
 
 global _plugin
 _plugin = BasePlugin()
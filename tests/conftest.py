@@ -0,0 +1,15 @@
+import pytest
+
+import harness
+
+@pytest.fixture
+def bench():
+    #Factory of started benches, all stopped at the end of the test
+    benches = []
+    def make(**kwargs):
+        started = harness.Bench(**kwargs)
+        benches.append(started)
+        return started.start()
+    yield make
+    for started in benches:
+        started.stop()
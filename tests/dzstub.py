@@ -0,0 +1,70 @@
+#Local json.htm endpoint (GAMMUDZ_URL) : records every call, answers switchlight, the user variables, system_reboot
+#and the bulk device list. A latency can be added to every answer
+import http.server
+import json
+import threading
+import time
+import urllib.parse
+
+class DomoticzStub:
+    def __init__(self, latency=0.0, devices=None):
+        self.latency = latency
+        self.calls = []
+        self.variables = {}
+        self.devices = devices if devices is not None else {}
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urllib.parse.urlparse(self.path)
+                params = dict(urllib.parse.parse_qsl(url.query))
+                if stub.latency:
+                    time.sleep(stub.latency)
+                body = json.dumps(stub.answer(url.path, params)).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:'+str(self.server.server_address[1])+'/json.htm'
+        self.thread = threading.Thread(target=self.server.serve_forever, name='DomoticzStub', daemon=True)
+        self.thread.start()
+
+    def answer(self, path, params):
+        with self.lock:
+            self.calls.append(params)
+            if path != '/json.htm':
+                return {'status':'ERR'}
+            if params.get('type') == 'devices':
+                return {'status':'OK', 'result':list(self.devices.values())}
+            command = params.get('param')
+            if command == 'switchlight':
+                device = self.devices.setdefault(params['idx'], {'idx':params['idx'], 'Name':'Device '+params['idx'], 'Data':'Off', 'LastUpdate':'2020-06-10 10:12:15'})
+                device['Data'] = params.get('switchcmd', '')+(' '+params['level'] if 'level' in params else '')
+                return {'status':'OK'}
+            if command == 'updateuservariable':
+                if params['vname'] not in self.variables:
+                    return {'status':'ERR'}
+                self.variables[params['vname']] = params['vvalue']
+                return {'status':'OK'}
+            if command == 'adduservariable':
+                self.variables[params['vname']] = params['vvalue']
+                return {'status':'OK'}
+            if command == 'system_reboot':
+                return {'status':'OK'}
+            return {'status':'ERR'}
+
+    def count(self, param):
+        with self.lock:
+            return len([call for call in self.calls if call.get('param', call.get('type')) == param])
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
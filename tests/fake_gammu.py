@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+#Stand-in for /usr/bin/gammu (GAMMUDZ_GAMMU) : answers the commands used by the CLI backend from a JSON state
+#file (FAKE_GAMMU_STATE) holding the stored SMS, the sent SMS, a latency, a busy error rate and a hang flag
+import fcntl
+import json
+import os
+import random
+import sys
+import time
+
+busy_error = 'Error opening device. Unknown, busy or no permissions.'
+
+def gammuDump(messages):
+    #'gammu getallsms' output for [{'location', 'sender', 'date', 'text', 'udh':[ref, part, total] or None}]
+    out = []
+    for sms in messages:
+        out.append('Location '+str(sms['location'])+', folder "Inbox", SIM memory, Inbox folder')
+        out.append('SMS message')
+        out.append('SMSC number          : "+33695000660"')
+        out.append('Sent                 : '+sms['date']+' +0200')
+        out.append('Coding               : Default GSM alphabet (no compression)')
+        out.append('Remote number        : "'+sms['sender']+'"')
+        out.append('Status               : UnRead')
+        if sms.get('udh'):
+            out.append('User Data Header     : Concatenated (linked) message, ID (8 bit) %d, part %d of %d' % tuple(sms['udh']))
+        out.append('')
+        out.append(sms['text'])
+        out.append('')
+    sequences = len(set((sms['sender'], tuple(sms['udh'][0::2])) if sms.get('udh') else sms['location'] for sms in messages))
+    out.append('')
+    out.append('%d SMS parts in %d SMS sequences' % (len(messages), sequences))
+    return '\n'.join(out)+'\n'
+
+class State:
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.file = open(self.path, 'a+')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        self.file.seek(0)
+        content = self.file.read()
+        self.data = json.loads(content) if content.strip() else {}
+        for name, default in (('sms', []), ('sent', []), ('latency', 0.0), ('busy', 0.0), ('hang', False)):
+            self.data.setdefault(name, default)
+        return self.data
+
+    def __exit__(self, *exc):
+        self.file.seek(0)
+        self.file.truncate()
+        json.dump(self.data, self.file)
+        self.file.close()
+
+def main(argv):
+    #Options before the command : --config FILE, -s SECTION
+    args = list(argv)
+    while len(args) > 0 and args[0] in ('--config', '-c', '-s', '--section'):
+        args = args[2:]
+    if len(args) == 0:
+        return 1
+    with State(os.environ['FAKE_GAMMU_STATE']) as state:
+        latency, busy, hang = state['latency'], state['busy'], state['hang']
+    if hang:
+        time.sleep(3600)
+    time.sleep(latency)
+    if busy and random.random() < busy:
+        print(busy_error)
+        return 2
+    command = args[0]
+    with State(os.environ['FAKE_GAMMU_STATE']) as state:
+        if command == 'getallsms':
+            sys.stdout.write(gammuDump(state['sms']))
+        elif command == 'batch':
+            for line in sys.stdin.read().splitlines():
+                fields = line.split()
+                if len(fields) == 3 and fields[0] == 'deletesms':
+                    state['sms'] = [sms for sms in state['sms'] if str(sms['location']) != fields[2]]
+        elif command == 'sendsms':
+            state['sent'].append({'number':args[2], 'text':args[args.index('-text')+1], 'unicode':'-unicode' in args})
+            print('Sending SMS 1/1....waiting for network answer..OK, message reference='+str(len(state['sent'])))
+        elif command == 'identify':
+            print('Device               : /dev/ttyUSB0\nManufacturer         : Simcom\nModel                : unknown (SIMCOM_SIM800L)\n'
+                  'Firmware             : Revision:1308B08SIM800L16\nIMEI                 : 860000000000001\nSIM IMSI             : 208011234567890')
+        elif command == 'networkinfo':
+            print('Network state        : home network\nNetwork              : 208 01 (Orange, France)\nLAC                  : 1A2B\n'
+                  'CID                  : 00C3\nName in phone        : "Orange F"')
+        elif command == 'getsignalquality':
+            print('Signal strength      : -73 dBm\nNetwork level        : 60 percent\nBit error rate       : 0 percent')
+        elif command == 'getsecuritystatus':
+            print('Nothing to enter.')
+        elif command == 'entersecuritycode':
+            print('Nothing to enter.')
+        else:
+            print('Bad parameter')
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
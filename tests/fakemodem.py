@@ -0,0 +1,234 @@
+#Simulated SIM800 : answers the AT commands used by the plugin on the master side of a pty, the plugin opens
+#the slave side with pyserial like a real UART. Latency, busy errors, jamming, registration loss and a
+#hung module can be set while it runs
+import collections
+import os
+import random
+import select
+import threading
+import time
+import tty
+
+import plugin
+
+#SMSC address stored at the head of each PDU (+33695000660)
+smsc = '07913396050006F6'
+
+def semiOctets(digits):
+    digits = digits+('F' if len(digits) % 2 else '')
+    return ''.join(digits[i+1]+digits[i] for i in range(0, len(digits), 2))
+
+def septetsFor(text):
+    septets = []
+    for c in text:
+        if c in plugin.gsm_extension:
+            septets.extend([0x1B, plugin.gsm_extension[c]])
+        else:
+            septets.append(plugin.gsm_alphabet.index(c))
+    return septets
+
+def pack(septets, fill_bits):
+    value = 0
+    for i, septet in enumerate(septets):
+        value |= septet << (fill_bits+7*i)
+    length = (fill_bits+7*len(septets)+7)//8
+    return value.to_bytes(length, 'little')
+
+def deliverPDUs(sender, text, reference=0, timestamp='200610101215', ucs2=None):
+    #SMS-DELIVER PDUs (hex, with the SMSC) of the text as a phone sends it, concatenated when too long
+    if ucs2 is None:
+        ucs2 = any(c not in plugin.gsm_alphabet and c not in plugin.gsm_extension for c in text)
+    if ucs2:
+        data = text.encode('utf-16-be')
+        units = [data[i:i+2] for i in range(0, len(data), 2)]
+        single, size = 70, 67
+    else:
+        units = septetsFor(text)
+        single, size = 160, 153
+    parts = [units] if len(units) <= single else [units[i:i+size] for i in range(0, len(units), size)]
+    digits = sender.lstrip('+')
+    address = '%02X%s%s' % (len(digits), '91' if sender.startswith('+') else '81', semiOctets(digits))
+    scts = semiOctets(timestamp)+'80'
+    pdus = []
+    for seq, part in enumerate(parts, 1):
+        udh = b''
+        if len(parts) > 1:
+            udh = bytes([5, 0, 3, reference & 0xFF, len(parts), seq])
+        if ucs2:
+            ud = udh+b''.join(part)
+            udl = len(ud)
+        else:
+            fill = (7-len(udh)*8 % 7) % 7 if udh else 0
+            ud = udh+pack(part, fill)
+            udl = (len(udh)*8+fill)//7+len(part)
+        first = 0x44 if udh else 0x04
+        pdus.append(smsc+'%02X' % first+address+'00'+('08' if ucs2 else '00')+scts+'%02X' % udl+ud.hex().upper())
+    return pdus
+
+class FakeModem(threading.Thread):
+    def __init__(self, latency=0.0, busy_rate=0.0, pin='', imei='860000000000001', seed=0):
+        threading.Thread.__init__(self, name='FakeModem', daemon=True)
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.latency = latency
+        self.busy_rate = busy_rate
+        self.random = random.Random(seed)
+        self.pin = pin
+        self.pin_ok = pin == ''
+        self.imei = imei
+        #index -> {'pdu', 'sender', 'text', 'date'}
+        self.storage = collections.OrderedDict()
+        self.sent = []
+        self.commands = []
+        self.echo = True
+        self.cmgf = 0
+        self.cnmi = False
+        self.registered = True
+        #rssi reported by AT+CSQ
+        self.csq = 20
+        self.jam = 0
+        self.hung = False
+        self.urc = None
+        self.running = True
+        self.write_lock = threading.Lock()
+        self.start()
+
+    def write(self, text):
+        with self.write_lock:
+            os.write(self.master, text.encode('latin-1'))
+
+    def run(self):
+        buffer = b''
+        prompt = None
+        while self.running:
+            try:
+                ready = select.select([self.master], [], [], 0.05)[0]
+                if not ready:
+                    continue
+                data = os.read(self.master, 4096)
+            except OSError:
+                break
+            if self.hung:
+                continue
+            buffer += data
+            while True:
+                if prompt is not None:
+                    #ESC cancels the SMS input
+                    cancel = buffer.find(b'\x1b')
+                    end = buffer.find(b'\x1a')
+                    if cancel >= 0 and (end < 0 or cancel < end):
+                        buffer = buffer[cancel+1:]
+                        prompt = None
+                        continue
+                    if end < 0:
+                        break
+                    pdu = buffer[:end].decode('ascii').strip()
+                    buffer = buffer[end+1:]
+                    self.sent.append(pdu)
+                    prompt = None
+                    self.respond(['+CMGS: '+str(len(self.sent) % 256)])
+                    continue
+                end = buffer.find(b'\r')
+                if end < 0:
+                    break
+                cmd = buffer[:end].decode('latin-1').replace('\x1b', '').strip()
+                buffer = buffer[end+1:]
+                if cmd == '':
+                    continue
+                self.commands.append(cmd)
+                if self.echo:
+                    self.write(cmd+'\r')
+                if self.latency:
+                    time.sleep(self.latency)
+                if cmd.upper().startswith('AT+CMGS=') and self.cmgf == 0:
+                    prompt = cmd
+                    self.write('\r\n> ')
+                    continue
+                self.answer(cmd)
+
+    def respond(self, lines, final='OK'):
+        self.write(''.join('\r\n'+line for line in lines)+('\r\n' if lines else '')+'\r\n'+final+'\r\n')
+
+    def answer(self, cmd):
+        u = cmd.upper()
+        if self.busy_rate and u not in ('AT', 'ATE0') and self.random.random() < self.busy_rate:
+            self.respond([], '+CME ERROR: 14')
+            return
+        if u == 'AT' or u.startswith(('AT+CSCS', 'AT+CREG=', 'AT+SJDR=', 'AT+CMEE', 'AT+CSDH')):
+            self.respond([])
+        elif u in ('ATE0', 'ATE1'):
+            self.echo = u == 'ATE1'
+            self.respond([])
+        elif u.startswith('AT+CMGF='):
+            self.cmgf = int(u[8:])
+            self.respond([])
+        elif u.startswith('AT+CNMI='):
+            self.cnmi = True
+            self.respond([])
+        elif u == 'AT+CPIN?':
+            self.respond(['+CPIN: READY' if self.pin_ok else '+CPIN: SIM PIN'])
+        elif u.startswith('AT+CPIN='):
+            self.pin_ok = cmd[8:].strip('"') == self.pin
+            self.respond([], 'OK' if self.pin_ok else '+CME ERROR: 16')
+        elif u in ('AT+CGMI', 'AT+CGMM', 'AT+CGMR', 'AT+CGSN', 'AT+CIMI'):
+            self.respond([{'AT+CGMI':'SIMCOM_Ltd', 'AT+CGMM':'SIMCOM_SIM800L', 'AT+CGMR':'Revision:1308B08SIM800L16', 'AT+CGSN':self.imei, 'AT+CIMI':'208011234567890'}[u]])
+        elif u == 'AT+CREG?':
+            self.respond(['+CREG: 2,1,"1A2B","00C3"' if self.registered else '+CREG: 2,0'])
+        elif u == 'AT+COPS?':
+            self.respond(['+COPS: 0,0,"Orange F"' if self.registered else '+COPS: 0'])
+        elif u == 'AT+CSQ':
+            self.respond(['+CSQ: '+str(self.csq)+',0'])
+        elif u == 'AT+SJDR?':
+            self.respond(['+SJDR: 1,0,255,0,'+str(self.jam)])
+        elif u.startswith('AT+CMGL'):
+            lines = []
+            for index, sms in list(self.storage.items()):
+                lines.extend(self.listing('+CMGL: '+str(index)+',', sms))
+            self.respond(lines)
+        elif u.startswith('AT+CMGR='):
+            sms = self.storage.get(int(u[8:]))
+            if sms is None:
+                self.respond([], '+CMS ERROR: 321')
+            else:
+                self.respond(self.listing('+CMGR: ', sms))
+        elif u.startswith('AT+CMGD='):
+            self.storage.pop(int(u[8:].split(',')[0]), None)
+            self.respond([])
+        elif u.startswith('AT+CMGS='):
+            #Text mode
+            self.respond([], 'ERROR')
+        else:
+            self.respond([], 'ERROR')
+
+    def listing(self, header, sms):
+        #urc : unsolicited line sent once between the next header and its SMS data
+        urc = [self.urc] if self.urc else []
+        self.urc = None
+        if self.cmgf == 0:
+            return [header+'0,,'+str(len(sms['pdu'])//2-8)]+urc+[sms['pdu']]
+        return [header+'"REC UNREAD","'+sms['sender']+'","","'+sms['date']+'"']+urc+[sms['text']]
+
+    def deliver(self, sender, text, reference=0, timestamp='200610101215', order=None, push=True):
+        #Store a SMS (one entry per part, in the given part order) and push +CMTI if the plugin asked for it
+        pdus = deliverPDUs(sender, text, reference, timestamp)
+        date = timestamp[0:2]+'/'+timestamp[2:4]+'/'+timestamp[4:6]+','+timestamp[6:8]+':'+timestamp[8:10]+':'+timestamp[10:12]+'+08'
+        indexes = []
+        for i in (order if order is not None else range(len(pdus))):
+            index = 1
+            while index in self.storage:
+                index += 1
+            self.storage[index] = {'pdu':pdus[i], 'sender':sender, 'text':text, 'date':date}
+            indexes.append(index)
+            if push and self.cnmi:
+                self.write('\r\n+CMTI: "SM",'+str(index)+'\r\n')
+        return indexes
+
+    def close(self):
+        self.running = False
+        self.join(1)
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
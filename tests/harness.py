@@ -0,0 +1,129 @@
+#Offline environment for the plugin : stub Domoticz module, fake modems on ptys, fake gammu CLI and a local
+#json.htm stub. Importing this module sets the GAMMUDZ_* overrides, it must be imported before the plugin
+import json
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+for path in (ROOT, os.path.join(HERE, 'stubs')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+workdir = tempfile.mkdtemp(prefix='gammudz_')
+os.environ['GAMMUDZ_GAMMU'] = os.path.join(HERE, 'fake_gammu.py')
+os.environ['GAMMUDZ_GAMMURC'] = os.path.join(workdir, 'gammurc')
+os.environ['GAMMUDZ_RESET'] = os.path.join(workdir, 'reset.py')
+os.environ['FAKE_GAMMU_STATE'] = os.path.join(workdir, 'gammu_state.json')
+
+import Domoticz
+import plugin
+from fakemodem import FakeModem
+from dzstub import DomoticzStub
+
+def percentiles(values):
+    #(p50, p95, max) in ms
+    values = sorted(values)
+    if len(values) == 0:
+        return 0, 0, 0
+    return tuple(round(1000*v, 1) for v in (values[int(0.5*(len(values)-1))], values[int(round(0.95*(len(values)-1)))], values[-1]))
+
+def gammuState(**values):
+    #Update the state file of the fake gammu CLI
+    path = os.environ['FAKE_GAMMU_STATE']
+    state = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            content = f.read()
+        state = json.loads(content) if content.strip() else {}
+    state.update(values)
+    with open(path, 'w') as f:
+        json.dump(state, f)
+    return state
+
+class Bench:
+    #One plugin instance against fake modems, the fake gammu CLI and the Domoticz stub.
+    #settings : plugin module constants overridden while the bench runs
+    def __init__(self, modems=1, backend='serial', latency=0.0, busy_rate=0.0, dz_latency=0.0,
+                 names='fan:12,light:13,bedroomlight:14', phones='+33601020304,+33601020305', passkey='cmd', settings=None,
+                 extra_ports=()):
+        self.modems = [FakeModem(latency, busy_rate, imei='86000000000000'+str(i), seed=i) for i in range(modems)]
+        #The paired devices are known by the json.htm stub
+        devices = dict((idx, {'idx':idx, 'Name':name, 'Data':'Off', 'LastUpdate':'2020-06-10 10:12:15'})
+                       for name, idx in (pairing.split(':') for pairing in names.split(',')))
+        self.dz = DomoticzStub(dz_latency, devices)
+        self.backend = backend
+        self.names = names
+        self.phones = phones
+        self.passkey = passkey
+        self.settings = dict(settings or {})
+        #Raw entries added to the additional ports field
+        self.extra_ports = list(extra_ports)
+        self.saved = {}
+        self.latencies = []
+        self.home = tempfile.mkdtemp(dir=workdir)
+        self.plugin = None
+
+    def start(self):
+        Domoticz.reset()
+        plugin.Devices = Domoticz.Devices
+        plugin.timings = plugin.StageTimings()
+        if not os.path.exists(os.environ['FAKE_GAMMU_STATE']):
+            gammuState(sms=[], sent=[])
+        settings = dict(self.settings)
+        settings.update(session_backend=self.backend, dz_url=self.dz.url)
+        for name, value in settings.items():
+            self.saved[name] = getattr(plugin, name)
+            setattr(plugin, name, value)
+        #Gammu config already matching the ports : no rewrite at start
+        config = '[gammu]\nport = \nconnection = \n'
+        for i, modem in enumerate(self.modems):
+            config = plugin.setGammuSection(config, 'gammu'+('' if i == 0 else str(i)), [['connection', 'at115200'], ['port', modem.port]])
+        with open(plugin.gammu_config, 'w') as f:
+            f.write(config)
+        plugin.Parameters = {'Mode1':'at115200', 'Mode2':'', 'Mode3':'', 'Mode4':self.passkey, 'Mode5':self.names, 'Mode6':'false',
+                             'Address':self.phones, 'SerialPort':self.modems[0].port, 'Port':','.join([modem.port for modem in self.modems[1:]]+self.extra_ports),
+                             'HomeFolder':self.home+os.sep}
+        self.plugin = plugin.BasePlugin()
+        self.plugin.onStart()
+        return self
+
+    def heartbeat(self):
+        start = time.time()
+        self.plugin.onHeartbeat()
+        self.latencies.append(time.time()-start)
+
+    def runUntil(self, condition, timeout=10, period=0.02):
+        #Heartbeats until the condition holds, returns its last value
+        deadline = time.time()+timeout
+        while not condition() and time.time() < deadline:
+            self.heartbeat()
+            time.sleep(period)
+        self.heartbeat()
+        return condition()
+
+    def sent(self):
+        #SMS sent by the modems : PDUs on the AT backend, gammu sendsms calls on the CLI one
+        if self.backend == 'cli':
+            return len(gammuState()['sent'])
+        return sum(len(modem.sent) for modem in self.modems)
+
+    def stop(self):
+        if self.plugin is not None:
+            self.plugin.onStop()
+            self.plugin = None
+        for name, value in self.saved.items():
+            setattr(plugin, name, value)
+        self.saved = {}
+        for modem in self.modems:
+            modem.close()
+        self.dz.close()
+        gammuState(sms=[], sent=[], latency=0.0, busy=0.0, hang=False)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+#Load scenarios against the offline bench, each returns a report with the heartbeat latency and the throughput.
+#   python tests/scenarios.py sms_flood --count 200 --latency 0.01
+#   python tests/scenarios.py notification_storm --count 1000
+#   python tests/scenarios.py hung_modem --hang 8
+import argparse
+import time
+
+import harness
+from harness import Bench, Domoticz, plugin, percentiles
+
+phone = '+33601020304'
+commands = ['cmd fan on', 'cmd light off', 'cmd bedroom light', 'cmd fan toggle / light on']
+
+def latencyReport(report, bench):
+    report['heartbeats'] = len(bench.latencies)
+    report['heartbeat_p50_ms'], report['heartbeat_p95_ms'], report['heartbeat_max_ms'] = percentiles(bench.latencies)
+    report['poll_p95_ms'] = plugin.timings.percentiles('poll')[1]
+    report['busy'] = plugin.timings.counters['busy']
+    report['threading_violations'] = len(Domoticz.violations)
+    return report
+
+def smsFlood(count=100, modems=1, backend='serial', latency=0.0, busy_rate=0.0, rate=600, settings=None, timeout=60):
+    #count command SMS received at once (spread over the modems), until all of them are processed
+    settings = dict(settings or {})
+    settings.setdefault('sms_rate_per_minute', rate)
+    bench = Bench(modems=modems, backend=backend, latency=latency, busy_rate=busy_rate, settings=settings)
+    try:
+        if backend == 'cli':
+            #No push with the CLI : the SMS are already stored when the first sweep runs
+            harness.gammuState(sms=[{'location':i+1, 'sender':phone, 'date':'Wed 10 Jun 2020 10:%02d:%02d AM' % (i//60 % 60, i % 60)+' '+str(i),
+                                     'text':commands[i % len(commands)], 'udh':None} for i in range(count)])
+        bench.start()
+        start = time.time()
+        if backend != 'cli':
+            for i in range(count):
+                bench.modems[i % modems].deliver(phone, commands[i % len(commands)], timestamp='2006%08d' % i)
+        processed = lambda: len(Domoticz.logged('Proceed Command')) >= count
+        done = bench.runUntil(processed, timeout)
+        elapsed = time.time()-start
+        bench.runUntil(lambda: len(bench.plugin.outbox.pending) == 0, timeout)
+        report = {'scenario':'sms_flood', 'backend':backend, 'modems':modems, 'count':count, 'complete':done,
+                  'processed':len(Domoticz.logged('Proceed Command')), 'elapsed_s':round(elapsed, 2),
+                  'throughput_sms_s':round(len(Domoticz.logged('Proceed Command'))/elapsed, 1),
+                  'replies_sent':bench.sent(), 'switchlight_calls':bench.dz.count('switchlight')}
+        return latencyReport(report, bench)
+    finally:
+        bench.stop()
+
+def notificationStorm(count=500, distinct=10, digest_delay=0.5, quota=10, timeout=30):
+    #count notifications of distinct subjects in a burst, some of them Emergency
+    bench = Bench(settings={'notify_digest_delay':digest_delay, 'notify_quota':quota, 'sms_rate_per_minute':600})
+    try:
+        bench.start()
+        calls = []
+        start = time.time()
+        for i in range(count):
+            t = time.time()
+            bench.plugin.onNotification('Sensor', 'door '+str(i % distinct), 'open', 'Alert', 2 if i % 100 == 0 else 1, '', '')
+            calls.append(time.time()-t)
+            if i % 50 == 0:
+                bench.heartbeat()
+        drained = lambda: len(bench.plugin.router.buffers) == 0 and len(bench.plugin.outbox.pending) == 0
+        bench.runUntil(drained, timeout)
+        elapsed = time.time()-start
+        report = {'scenario':'notification_storm', 'count':count, 'distinct':distinct, 'elapsed_s':round(elapsed, 2),
+                  'sms_queued':len(Domoticz.logged('Notification queued')), 'sms_sent':bench.sent(),
+                  'notify_duplicate':plugin.timings.counters['notify_duplicate'], 'notify_merged':plugin.timings.counters['notify_merged'],
+                  'notify_quota':plugin.timings.counters['notify_quota']}
+        report['notify_p50_ms'], report['notify_p95_ms'], report['notify_max_ms'] = percentiles(calls)
+        return latencyReport(report, bench)
+    finally:
+        bench.stop()
+
+def hungModem(hang=12.0, timeout=30):
+    #The modem stops answering for hang seconds : the heartbeat must stay fast and the modem be back in service.
+    #A hang shorter than the AT timeout is absorbed by the pending command, a longer one fails the network job
+    #and goes through recover()
+    bench = Bench(settings={'schedule_jobs':{'sms':[1, 0], 'jamming':[1, 1], 'network':[1, 2], 'identify':[21600, 3]}})
+    try:
+        bench.start()
+        bench.runUntil(lambda: False, 0.5)
+        before = len(bench.latencies)
+        bench.modems[0].hung = True
+        start = time.time()
+        bench.runUntil(lambda: False, hang)
+        during = bench.latencies[before:]
+        bench.modems[0].hung = False
+        back = time.time()
+        logs = len(Domoticz.logs)
+        #Back in service : a network job answered after the hang
+        answered = lambda: any(kind == 'debug' and msg.startswith('Network state') for kind, msg in Domoticz.logs[logs:])
+        done = bench.runUntil(answered, timeout)
+        report = {'scenario':'hung_modem', 'hang_s':hang, 'back_in_service':done, 'back_s':round(time.time()-back, 2),
+                  'recoveries':[(tier, ok, round(duration, 2)) for t, tier, ok, duration in bench.plugin.recoveries if t > start]}
+        report['hung_heartbeat_p95_ms'], report['hung_heartbeat_max_ms'] = percentiles(during)[1:]
+        return latencyReport(report, bench)
+    finally:
+        bench.stop()
+
+scenarios = {'sms_flood':smsFlood, 'notification_storm':notificationStorm, 'hung_modem':hungModem}
+
+def main():
+    parser = argparse.ArgumentParser(description='GammuDz offline load scenarios')
+    parser.add_argument('scenario', choices=sorted(scenarios)+['all'])
+    parser.add_argument('--count', type=int)
+    parser.add_argument('--modems', type=int)
+    parser.add_argument('--backend', choices=['serial', 'cli'])
+    parser.add_argument('--latency', type=float, help='modem answer latency (s)')
+    parser.add_argument('--busy', dest='busy_rate', type=float, help='rate of busy errors from the modem')
+    parser.add_argument('--hang', type=float, help='hung modem duration (s)')
+    args = parser.parse_args()
+    names = sorted(scenarios) if args.scenario == 'all' else [args.scenario]
+    for name in names:
+        function = scenarios[name]
+        kwargs = dict((key, value) for key, value in vars(args).items() if key != 'scenario' and value is not None and key in function.__code__.co_varnames)
+        report = function(**kwargs)
+        print(name)
+        for key, value in report.items():
+            print('  '+key+': '+str(value))
+
+if __name__ == '__main__':
+    main()
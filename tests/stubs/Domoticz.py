@@ -0,0 +1,67 @@
+#Stand-in for the module Domoticz injects into the plugin : logs are kept in memory, created devices in Devices.
+#Domoticz only accepts API calls from the plugin thread, calls from any other thread are recorded in violations
+import threading
+
+Devices = {}
+logs = []
+violations = []
+
+def checkThread(call):
+    if threading.current_thread() is not threading.main_thread():
+        violations.append((threading.current_thread().name, call))
+
+def Log(message):
+    checkThread('Log')
+    logs.append(('log', str(message)))
+
+def Debug(message):
+    checkThread('Debug')
+    logs.append(('debug', str(message)))
+
+def Error(message):
+    checkThread('Error')
+    logs.append(('error', str(message)))
+
+def Debugging(level):
+    pass
+
+def Heartbeat(interval):
+    pass
+
+def Notifier(name):
+    pass
+
+class Device:
+    def __init__(self, Name, Unit, TypeName='', DeviceID='', Options=None, **kwargs):
+        self.Name = Name
+        self.Unit = Unit
+        self.ID = Unit
+        self.TypeName = TypeName
+        self.DeviceID = DeviceID
+        self.Options = Options
+        self.nValue = 0
+        self.sValue = ''
+        self.LastLevel = 0
+        self.updates = 0
+
+    def Create(self):
+        checkThread('Create')
+        Devices[self.Unit] = self
+
+    def Update(self, nValue=0, sValue=''):
+        checkThread('Update')
+        self.nValue = nValue
+        self.sValue = sValue
+        self.updates += 1
+
+    def __str__(self):
+        return self.Name
+
+def reset():
+    Devices.clear()
+    del logs[:]
+    del violations[:]
+
+def logged(text):
+    #Log lines containing text
+    return [message for kind, message in logs if text in message]
@@ -0,0 +1,74 @@
+#AT response framing against a fake modem
+import serial
+
+import harness
+from harness import plugin
+from fakemodem import FakeModem
+
+def openChannel(modem):
+    ser = serial.Serial(port=modem.port, baudrate=115200, timeout=plugin.at_read_timeout)
+    return ser, plugin.ATChannel(ser)
+
+def test_text_mode_sms_reading_ok():
+    #The SMS text 'OK' must not end the listing. Text mode only : a text starting like an unsolicited code
+    #cannot be told apart from it, the plugin reads in PDU mode
+    modem = FakeModem()
+    ser, channel = openChannel(modem)
+    try:
+        assert channel.command('AT+CMGF=1')[0]
+        modem.deliver('+33601020304', 'OK', push=False)
+        modem.deliver('+33601020305', 'ERROR', push=False)
+        modem.deliver('+33601020304', 'cmd fan on', push=False)
+        ok, lines = channel.command('AT+CMGL="ALL"')
+        assert ok
+        assert [line for line in lines if not line.startswith('+CMGL:')] == ['OK', 'ERROR', 'cmd fan on']
+        assert channel.unsolicited == []
+        ok, lines = channel.command('AT+CMGR=1')
+        assert ok and lines[1] == 'OK'
+    finally:
+        ser.close()
+        modem.close()
+
+def test_unsolicited_kept_aside():
+    modem = FakeModem()
+    ser, channel = openChannel(modem)
+    try:
+        assert channel.command('AT+CNMI=2,1,0,0,0')[0]
+        modem.deliver('+33601020304', 'cmd fan on')
+        ok, lines = channel.command('AT+CSQ')
+        assert ok and lines[0].startswith('+CSQ:')
+        assert channel.pollUnsolicited() == ['+CMTI: "SM",1']
+    finally:
+        ser.close()
+        modem.close()
+
+def test_error_result():
+    modem = FakeModem()
+    ser, channel = openChannel(modem)
+    try:
+        ok, lines = channel.command('AT+CMGR=9')
+        assert not ok and lines[-1].startswith(plugin.at_final_error)
+    finally:
+        ser.close()
+        modem.close()
+
+def test_creg_inside_responses():
+    #+CREG: cell change reports are unsolicited, except in the answer to AT+CREG?
+    modem = FakeModem()
+    ser, channel = openChannel(modem)
+    try:
+        modem.deliver('+33601020304', 'cmd fan on', push=False)
+        modem.deliver('+33601020305', 'cmd light on', push=False)
+        modem.urc = '+CREG: 1,"1A2B","00C4"'
+        ok, lines = channel.command('AT+CMGR=1')
+        assert ok and len(lines) == 2 and plugin.decodePDU(1, lines[1]).text == 'cmd fan on'
+        modem.urc = '+CREG: 1,"1A2B","00C5"'
+        ok, lines = channel.command('AT+CMGL=4')
+        assert ok and [plugin.decodePDU(1, pdu).text for pdu in lines[1::2]] == ['cmd fan on', 'cmd light on']
+        assert channel.pollUnsolicited() == ['+CREG: 1,"1A2B","00C4"', '+CREG: 1,"1A2B","00C5"']
+        ok, lines = channel.command('AT+CREG?')
+        assert ok and lines[0].startswith('+CREG: 2,1')
+        assert channel.pollUnsolicited() == []
+    finally:
+        ser.close()
+        modem.close()
@@ -0,0 +1,84 @@
+#AT backend in PDU mode against a fake modem
+import harness
+from harness import plugin
+from fakemodem import FakeModem, pack, semiOctets, septetsFor, smsc
+
+def openSession(modem):
+    session = plugin.ATSession(modem.port, 115200)
+    assert session.open()
+    return session
+
+def test_decode_pdu():
+    #Reference SMS-DELIVER from the GSM 03.40 examples
+    sms = plugin.decodePDU('3', '07911326040000F0040B911346610089F60000208062917314080CC8F71D14969741F977FD07')
+    assert (sms.locations, sms.sender, sms.udh, sms.text) == (('3',), '+31641600986', None, 'How are you?')
+    assert sms.date.startswith('02/08/26,19:37:41')
+
+def test_decode_pdu_alphanumeric_sender():
+    name = pack(septetsFor('Orange'), 0).hex().upper()
+    pdu = smsc+'04'+'0BD0'+name+'0000'+semiOctets('200610215100')+'80'+'03'+pack(septetsFor('[a'), 0).hex().upper()
+    sms = plugin.decodePDU('1', pdu)
+    assert (sms.sender, sms.date, sms.text) == ('Orange', '20/06/10,21:51:00+08', '[a')
+
+def test_read_multipart_out_of_order():
+    modem = FakeModem()
+    session = openSession(modem)
+    try:
+        assert modem.cmgf == 0
+        text = 'cmd fan on / '+'light off, '*30
+        ucs2 = 'cmd été ☃ '*12
+        modem.deliver('+33601020304', text, reference=12, order=[2, 0, 1], push=False)
+        modem.deliver('+33601020305', 'cmd light on', push=False)
+        modem.deliver('+33601020304', ucs2, reference=13, order=[1, 0], push=False)
+        status, messages = session.getAllSMS()
+        assert status == 'ok'
+        assert [(sms.sender, sms.text) for sms in messages] == [('+33601020304', text), ('+33601020305', 'cmd light on'), ('+33601020304', ucs2)]
+        assert messages[0].udh == (12, 3, 3)
+        #Locations in part order
+        assert messages[0].locations == ('2', '3', '1')
+        assert messages[0].date == '20/06/10,10:12:15+08'
+        #One part alone keeps its header
+        part = session.readSMS(1)
+        assert part.udh == (12, 3, 3)
+        assert session.readSMS(9) is None
+    finally:
+        session.close()
+        modem.close()
+
+def test_incomplete_sequence():
+    modem = FakeModem()
+    session = openSession(modem)
+    try:
+        modem.deliver('+33601020304', 'x'*400, reference=5, push=False)
+        del modem.storage[2]
+        messages = session.getAllSMS()[1]
+        assert len(messages) == 1 and messages[0].udh == (5, 2, 3)
+    finally:
+        session.close()
+        modem.close()
+
+def test_send_stays_in_pdu_mode():
+    modem = FakeModem()
+    session = openSession(modem)
+    try:
+        assert session.sendSMS('+33601020304', 'Reboot now')
+        assert len(modem.sent) == 1
+        assert not any(cmd.upper() == 'AT+CMGF=1' for cmd in modem.commands)
+    finally:
+        session.close()
+        modem.close()
+
+def test_reopen_after_interrupted_send():
+    #The modem still waits for the PDU of a send cut short : ESC at open cancels it
+    modem = FakeModem()
+    session = openSession(modem)
+    try:
+        session.command('AT+CMGS=20', 0.3)
+        session.close()
+        assert session.open()
+        modem.deliver('+33601020304', 'cmd fan on', push=False)
+        assert [sms.text for sms in session.getAllSMS()[1]] == ['cmd fan on']
+        assert modem.sent == []
+    finally:
+        session.close()
+        modem.close()
@@ -0,0 +1,67 @@
+#Device names lookup in the command lines
+import random
+import time
+
+import harness
+from harness import plugin
+
+def naiveMatch(name_idx, sms_cmd):
+    #Reference : earliest start, then the longest name there
+    names = [n_idx.split(':', 1) for n_idx in name_idx.split(',') if ':' in n_idx and not n_idx.startswith(':')]
+    for start in range(len(sms_cmd)):
+        found = [(key, idx) for key, idx in names if sms_cmd.startswith(key, start)]
+        if len(found) > 0:
+            key, idx = max(found, key=lambda name: len(name[0]))
+            return (key, idx, sms_cmd[start+len(key):])
+    return None
+
+def test_longest_match():
+    trie = plugin.buildCommandIndex('light:13,bedroomlight:14,fan:12')
+    assert plugin.matchCommand(trie, 'bedroomlighton') == ('bedroomlight', '14', 'on')
+    assert plugin.matchCommand(trie, 'lighton') == ('light', '13', 'on')
+    assert plugin.matchCommand(trie, 'bedroomlig') is None
+
+def test_earliest_position():
+    trie = plugin.buildCommandIndex('light:13,bedroomlight:14,room:15')
+    #'bedroomlight' starts before 'room' and 'light'
+    assert plugin.matchCommand(trie, 'xbedroomlightoff') == ('bedroomlight', '14', 'off')
+    assert plugin.matchCommand(trie, 'xbedroomlamp') == ('room', '15', 'lamp')
+    trie = plugin.buildCommandIndex('ab:1,bcdef:2')
+    assert plugin.matchCommand(trie, 'abcdef') == ('ab', '1', 'cdef')
+
+def test_suffix_links():
+    #'abcd' fails after 'abc' : 'bc' then 'bcx' must still be found
+    trie = plugin.buildCommandIndex('abcd:1,bcx:2,c:3')
+    assert plugin.matchCommand(trie, 'abcx') == ('bcx', '2', '')
+    assert plugin.matchCommand(trie, 'abcd') == ('abcd', '1', '')
+    assert plugin.matchCommand(trie, 'abce') == ('c', '3', 'e')
+
+def test_ignored_pairings():
+    trie = plugin.buildCommandIndex(':3,fan,light:13,')
+    assert plugin.matchCommand(trie, 'fanon') is None
+    assert plugin.matchCommand(trie, 'lightfan') == ('light', '13', 'fan')
+    assert plugin.matchCommand(plugin.buildCommandIndex(''), 'lighton') is None
+
+def test_same_as_reference():
+    rng = random.Random(5)
+    for _ in range(300):
+        names = ','.join(''.join(rng.choice('abc') for _ in range(rng.randint(1, 4)))+':'+str(i) for i in range(rng.randint(1, 6)))
+        #Duplicate names : the last pairing wins, as in the trie
+        unique = ','.join(dict((n.split(':')[0], n) for n in names.split(',')).values())
+        trie = plugin.buildCommandIndex(names)
+        for _ in range(10):
+            sms_cmd = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 12)))
+            assert plugin.matchCommand(trie, sms_cmd) == naiveMatch(unique, sms_cmd)
+
+def test_benchmark_many_pairings():
+    names = ['room'+str(i)+'light' for i in range(300)]+['fan', 'light', 'bedroomlight']
+    name_idx = ','.join(name+':'+str(i) for i, name in enumerate(names))
+    trie = plugin.buildCommandIndex(name_idx)
+    lines = ['cmd'+names[i*7 % len(names)]+'on' for i in range(500)]+['cmd'+'x'*150+'nothing' for i in range(500)]
+    start = time.time()
+    for sms_cmd in lines:
+        plugin.matchCommand(trie, sms_cmd)
+    elapsed = time.time()-start
+    assert plugin.matchCommand(trie, 'cmdroom299lighton') == ('room299light', '299', 'on')
+    #1000 lines on 303 pairings, a few ms
+    assert elapsed < 0.5
@@ -0,0 +1,34 @@
+#Device updates : Domoticz is only written to when a value changed, the signal with a deadband
+from harness import Domoticz, plugin
+
+def networkPolls():
+    return plugin.timings.counters['networkinfo']
+
+def updates(b, uid):
+    return Domoticz.Devices[b.plugin.modems[0].unit(uid)].updates
+
+def test_update_only_on_change(bench):
+    b = bench(settings={'schedule_jobs':{'sms':[20, 0], 'jamming':[3600, 1], 'network':[0.3, 2], 'identify':[21600, 3]}})
+    modem = b.modems[0]
+    assert b.runUntil(lambda: networkPolls() >= 1 and updates(b, plugin.uid_signal) == 1, 10)
+    info, netstat, signal = (updates(b, uid) for uid in (plugin.uid_GSMinfo, plugin.uid_netstat, plugin.uid_signal))
+    #Same network info : no Update at all
+    polls = networkPolls()
+    assert b.runUntil(lambda: networkPolls() >= polls+3, 10)
+    assert (updates(b, plugin.uid_GSMinfo), updates(b, plugin.uid_netstat), updates(b, plugin.uid_signal)) == (info, netstat, signal)
+    #64% -> 67%, under the signal deadband
+    modem.csq = 21
+    polls = networkPolls()
+    assert b.runUntil(lambda: networkPolls() >= polls+3, 10)
+    assert updates(b, plugin.uid_signal) == signal
+    #64% -> 80%
+    modem.csq = 25
+    assert b.runUntil(lambda: updates(b, plugin.uid_signal) == signal+1, 10)
+    assert Domoticz.Devices[b.plugin.modems[0].unit(plugin.uid_signal)].sValue == '80'
+    #Registration lost : state device updated, once
+    modem.registered = False
+    assert b.runUntil(lambda: updates(b, plugin.uid_netstat) == netstat+1, 10)
+    polls = networkPolls()
+    assert b.runUntil(lambda: networkPolls() >= polls+3, 10)
+    assert updates(b, plugin.uid_netstat) == netstat+1
+    assert not b.plugin.modems[0].healthy()
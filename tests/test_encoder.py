@@ -0,0 +1,59 @@
+#SMS-SUBMIT encoding, checked against PDUs decoded independently
+import harness
+from harness import plugin
+
+def test_single_7bit():
+    #'hellohello', the GSM 03.40 packing example
+    assert plugin.encodeSMS('+46708251358', 'hellohello', 0) == [
+        ('0001000B916407281553F800000AE8329BFD4697D9EC37', 22),
+    ]
+
+def test_multipart_7bit():
+    #Multipart 7-bit : 153 septets after the 6 bytes header and its fill bit
+    assert plugin.encodeSMS('+33601020304', 'x'*200, 7) == [
+        ('0041000B913306010203F40000A0050003070201F0783C1E8FC7E3F1783C1E8FC7E3F1783C1E8FC7E3F1783C1E8FC7E3F1783C1E8FC7E3F1783C1E8FC7E3F1783C1E8FC7E3F1783C1E8FC7E3F1783C1E8FC7E3F1783C1E8FC7E3F1783C1E8FC7E3F1783C1E8FC7E3F1783C1E8FC7E3F1783C1E8FC7E3F1783C1E8FC7E3F1783C1E8FC7E3F1783C1E8FC7E3F1783C1E8FC7E3F1783C1E8FC7E3F1', 153),
+        ('0041000B913306010203F4000036050003070202F0783C1E8FC7E3F1783C1E8FC7E3F1783C1E8FC7E3F1783C1E8FC7E3F1783C1E8FC7E3F1783C1E8FC703', 61),
+    ]
+
+def test_multipart_ucs2():
+    #Multipart UCS2 : 67 units per part
+    assert plugin.encodeSMS('+33601020304', '\u00ea'*100, 8) == [
+        ('0041000B913306010203F400088C05000308020100EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA', 153),
+        ('0041000B913306010203F400084805000308020200EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA00EA', 85),
+    ]
+
+def test_split_before_escape():
+    #The escape 0x1B of the euro sign would be the 153rd septet : the part ends before it
+    assert plugin.encodeSMS('0601020304', 'a'*152+'\u20ac'+'b'*10, 3) == [
+        ('0041000A81601020304000009F050003030201C2E170381C0E87C3E170381C0E87C3E170381C0E87C3E170381C0E87C3E170381C0E87C3E170381C0E87C3E170381C0E87C3E170381C0E87C3E170381C0E87C3E170381C0E87C3E170381C0E87C3E170381C0E87C3E170381C0E87C3E170381C0E87C3E170381C0E87C3E170381C0E87C3E170381C0E87C3E170381C0E87C3E170381C0E8701', 152),
+        ('0041000A8160102030400000130500030302023665B1582C168BC562B118', 29),
+    ]
+
+def test_split_before_surrogate_pair():
+    #The high surrogate of the emoji would be the 67th unit : the part ends before it
+    assert plugin.encodeSMS('+33601020304', 'a'*66+'\U0001F600'+'b'*10, 4) == [
+        ('0041000B913306010203F400088A050003040201006100610061006100610061006100610061006100610061006100610061006100610061006100610061006100610061006100610061006100610061006100610061006100610061006100610061006100610061006100610061006100610061006100610061006100610061006100610061006100610061006100610061006100610061', 151),
+        ('0041000B913306010203F400081E050003040202D83DDE000062006200620062006200620062006200620062', 43),
+    ]
+
+def test_units_per_part():
+    assert len(plugin.encodeSMS('+33601020304', 'x'*160, 1)) == 1
+    assert len(plugin.encodeSMS('+33601020304', 'x'*161, 1)) == 2
+    assert len(plugin.encodeSMS('+33601020304', '\u00ea'*70, 1)) == 1
+    assert len(plugin.encodeSMS('+33601020304', '\u00ea'*71, 1)) == 2
+    #An emoji is two UTF-16 units
+    assert len(plugin.encodeSMS('+33601020304', '\U0001F600'*35, 1)) == 1
+    assert len(plugin.encodeSMS('+33601020304', '\U0001F600'*36, 1)) == 2
+
+def test_sent_text_round_trip():
+    #Each part decodes alone : no escape sequence nor surrogate pair across two parts
+    for text in ['\u20ac'*100, 'a'+'\U0001F600'*80, 'x'*152+'[]'*20]:
+        parts = []
+        for pdu, length in plugin.encodeSMS('+33601020304', text, 1):
+            data = bytes.fromhex(pdu)
+            udl, ud = data[13], data[14:]
+            if data[12] == 0x08:
+                parts.append(ud[6:].decode('utf-16-be'))
+            else:
+                parts.append(plugin.gsmText(plugin.unpackSeptets(ud, udl)[7:]))
+        assert ''.join(parts) == text
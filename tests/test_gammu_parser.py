@@ -0,0 +1,52 @@
+#'gammu getallsms' parsing and reassembly of concatenated SMS
+import os
+import time
+
+import harness
+from harness import plugin
+
+fixtures = os.path.join(harness.HERE, 'fixtures')
+
+def fixture(name):
+    with open(os.path.join(fixtures, name)) as f:
+        return f.read()
+
+def test_multiline_bodies():
+    records = list(plugin.parseGammuSMS(fixture('getallsms_multiline.txt')))
+    assert records == [plugin.SMSRecord(('1',), '+33601020304', 'Wed 10 Jun 2020 10:12:15 AM', None, 'cmd fan on\nlight off\n\nbedroom light'),
+                       plugin.SMSRecord(('2',), '+33601020305', 'Wed 10 Jun 2020 10:13:00 AM', None, 'cmd light')]
+
+def test_udh_line():
+    records = list(plugin.parseGammuSMS(fixture('getallsms_multipart.txt')))
+    assert [sms.udh for sms in records] == [(42, 2, 3), None, (42, 1, 3), (42, 3, 3), (7, 1, 2)]
+    assert records[2].text == 'first part '
+
+def test_out_of_order_parts():
+    messages = plugin.reassembleSMS(plugin.parseGammuSMS(fixture('getallsms_multipart.txt')))
+    assert messages[0] == plugin.SMSRecord(('5', '3', '6'), '+33601020304', 'Wed 10 Jun 2020 10:14:01 AM', (42, 3, 3), 'first part second part third part')
+    assert messages[1].text == 'cmd fan off'
+
+def test_incomplete_sequence():
+    messages = plugin.reassembleSMS(plugin.parseGammuSMS(fixture('getallsms_multipart.txt')))
+    #Part 1 of 2 only : returned with the parts received so far, udh[1] < udh[2]
+    assert messages[2] == plugin.SMSRecord(('7',), '+33601020305', 'Wed 10 Jun 2020 10:15:00 AM', (7, 1, 2), 'only part 1')
+    assert len(messages) == 3
+
+def test_same_reference_other_sender():
+    dump = fixture('getallsms_multipart.txt').replace('ID (8 bit) 7,', 'ID (8 bit) 42,')
+    messages = plugin.reassembleSMS(plugin.parseGammuSMS(dump))
+    assert [sms.udh for sms in messages] == [(42, 3, 3), None, (42, 1, 2)]
+
+def test_500_messages():
+    dump = fixture('getallsms_500.txt')
+    start = time.time()
+    records = list(plugin.parseGammuSMS(dump))
+    messages = plugin.reassembleSMS(records)
+    elapsed = time.time()-start
+    assert len(records) == 500
+    assert len(messages) == 475
+    assert messages[0].text == 'cmd fan on 0' and messages[449].text == 'cmd fan on 449'
+    assert messages[450] == plugin.SMSRecord(('452', '451'), '+33601020304', 'Wed 10 Jun 2020 11:00:00 AM', (0, 2, 2), 'long 0 part 1 long 0 part 2 ')
+    assert all(sms.udh[1] == sms.udh[2] for sms in messages[450:])
+    #Single pass : far below the gammu call itself
+    assert elapsed < 0.5
@@ -0,0 +1,42 @@
+#SMS journal : a command processed but not yet deleted from the SIM is not run again after a crash
+import os
+
+from harness import Domoticz, plugin
+
+def test_journal_persisted(tmp_path):
+    path = str(tmp_path/'journal.json')
+    sms = plugin.SMSRecord(('1',), '+33601020304', '20/06/10,10:12:15+08', None, 'cmd fan on')
+    other = sms._replace(text='cmd fan off')
+    journal = plugin.SMSJournal(path)
+    journal.markDone(sms)
+    journal.markDone(other)
+    #Reloaded as after a restart
+    journal = plugin.SMSJournal(path)
+    assert journal.isDone(sms) and journal.isDone(other)
+    journal.forget([sms])
+    assert not plugin.SMSJournal(path).isDone(sms)
+    assert plugin.SMSJournal(path).isDone(other)
+
+def test_unreadable_journal(tmp_path):
+    path = str(tmp_path/'journal.json')
+    with open(path, 'w') as f:
+        f.write('{truncated')
+    assert not plugin.SMSJournal(path).isDone(plugin.SMSRecord(('1',), '', '', None, ''))
+
+def test_replay_after_crash(bench):
+    b = bench()
+    modem = b.modems[0]
+    #Crash between the command and the deletion : the SMS stays on the SIM
+    b.plugin.modems[0].session.deleteSMS = lambda locations: []
+    modem.deliver('+33601020304', 'cmd fan on')
+    assert b.runUntil(lambda: b.dz.count('switchlight') == 1, 5)
+    assert len(modem.storage) == 1
+    b.plugin.onStop()
+    #Restart : the first sweep finds the SMS again, it is only deleted
+    b.plugin = plugin.BasePlugin()
+    b.plugin.onStart()
+    assert b.runUntil(lambda: len(modem.storage) == 0, 5)
+    assert b.dz.count('switchlight') == 1
+    assert len(Domoticz.logged('already processed')) >= 1
+    #Deleted : the entry is dropped from the journal
+    assert not b.plugin.journal.isDone(plugin.SMSRecord(('1',), '+33601020304', '20/06/10,10:12:15+08', None, 'cmd fan on'))
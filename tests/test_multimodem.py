@@ -0,0 +1,169 @@
+#Several GSM modules : outbound SMS failover and the [gammuN] sections of the gammu config
+import threading
+import time
+
+import pytest
+
+from harness import Domoticz, plugin
+
+class StubSession:
+    ready = True
+    def __init__(self, modem, fail=False):
+        self.modem = modem
+        self.fail = fail
+        self.sent = []
+
+    def sendSMS(self, number, text):
+        if self.fail:
+            #Jams while sending
+            self.modem.jammed = True
+            return False
+        self.sent.append((number, text))
+        return True
+
+@pytest.fixture
+def modems(monkeypatch):
+    monkeypatch.setattr(plugin, 'sms_retry_delays', [0, 0, 0])
+    monkeypatch.setattr(plugin, 'heartbeat_interval', 0.05)
+    modems = [plugin.Modem(i, '/dev/ttyS'+str(i), '') for i in range(2)]
+    for modem in modems:
+        modem.session = StubSession(modem)
+    return modems
+
+def runOutbox(modems, texts, timeout=5):
+    outbox = plugin.SMSOutbox(modems, lambda *args: None)
+    outbox.start()
+    ids = [outbox.send('+33601020304', text) for text in texts]
+    statuses = [outbox.wait(sms_id, timeout) for sms_id in ids]
+    outbox.stop()
+    for sender in outbox.senders:
+        sender.join(1)
+    return statuses
+
+def test_jammed_modem_skipped(modems):
+    modems[0].jammed = True
+    assert runOutbox(modems, ['alert '+str(i) for i in range(5)]) == ['sent']*5
+    assert modems[0].session.sent == []
+    assert len(modems[1].session.sent) == 5
+
+def test_retry_on_other_modem(modems, monkeypatch):
+    monkeypatch.setattr(plugin, 'sms_retry_delays', [0.5, 0.5, 0.5])
+    modems[0].session.fail = True
+    modems[1].session.ready = False
+    #Only modem 0 is usable : it takes the message, fails and jams
+    outbox = plugin.SMSOutbox(modems, lambda *args: None)
+    outbox.start()
+    sms_id = outbox.send('+33601020304', 'alert')
+    deadline = time.time()+5
+    while not modems[0].jammed and time.time() < deadline:
+        time.sleep(0.01)
+    #Modem 1 comes back : the retry goes there
+    modems[1].session.ready = True
+    assert outbox.wait(sms_id, 5) == 'sent'
+    outbox.stop()
+    assert modems[1].session.sent == [('+33601020304', 'alert')]
+
+def test_no_healthy_modem_still_sends(modems):
+    modems[0].jammed = True
+    modems[1].registered = False
+    assert runOutbox(modems, ['alert']) == ['sent']
+    assert len(modems[0].session.sent)+len(modems[1].session.sent) == 1
+
+def test_failover_from_jam_detection(bench):
+    b = bench(modems=2, settings={'schedule_jobs':{'sms':[20, 0], 'jamming':[0.2, 1], 'network':[60, 2], 'identify':[21600, 3]}})
+    b.modems[0].jam = 1
+    assert b.runUntil(lambda: b.plugin.modems[0].jammed, 5)
+    for i in range(4):
+        b.plugin.outbox.send('+33601020304', 'alert '+str(i))
+    assert b.runUntil(lambda: len(b.modems[1].sent) == 4, 5)
+    assert b.modems[0].sent == []
+
+config = """; gammu config
+[gammu]
+port = /dev/ttyS0
+connection = at115200
+logformat = textall
+
+[gammu1]
+# second module
+connection = at19200
+port = /dev/ttyUSB0
+model = at
+
+[gammu10]
+port = /dev/ttyUSB9
+connection = at115200
+"""
+
+def test_section_rewritten_in_place():
+    out = plugin.setGammuSection(config, 'gammu1', [['connection', 'at115200'], ['port', '/dev/ttyAMA0']])
+    assert out == config.replace('connection = at19200\nport = /dev/ttyUSB0', 'connection = at115200\nport = /dev/ttyAMA0')
+    #Idempotent
+    assert plugin.setGammuSection(out, 'gammu1', [['connection', 'at115200'], ['port', '/dev/ttyAMA0']]) == out
+
+def test_section_prefix_not_mixed():
+    out = plugin.setGammuSection(config, 'gammu', [['port', '/dev/serial0']])
+    assert out == config.replace('port = /dev/ttyS0', 'port = /dev/serial0')
+
+def test_missing_key_and_section():
+    out = plugin.setGammuSection(config, 'gammu10', [['model', 'at']])
+    assert '[gammu10]\nmodel = at\nport = /dev/ttyUSB9\n' in out
+    out = plugin.setGammuSection(config, 'gammu2', [['connection', 'at115200'], ['port', '/dev/ttyUSB1']])
+    assert out == config+'\n[gammu2]\nconnection = at115200\nport = /dev/ttyUSB1\n'
+
+def test_empty_values():
+    #The default .gammurc has the keys without values
+    out = plugin.setGammuSection('[gammu]\nport = \nconnection = \n', 'gammu', [['connection', 'at115200'], ['port', '/dev/ttyAMA0']])
+    assert out == '[gammu]\nport = /dev/ttyAMA0\nconnection = at115200\n'
+
+def test_extra_ports_parsing():
+    assert plugin.parseExtraPorts('', '1234') == ([], [])
+    assert plugin.parseExtraPorts(0, '1234') == ([], [])
+    assert plugin.parseExtraPorts('/dev/ttyUSB1, /dev/ttyUSB2:0000,8080,COM3', '1234') == \
+        ([('/dev/ttyUSB1', '1234'), ('/dev/ttyUSB2', '0000'), ('COM3', '1234')], ['8080'])
+
+def test_missing_extra_port_left_out(bench):
+    b = bench(modems=2, extra_ports=['/dev/ttyDOESNOTEXIST', '8080'])
+    assert [modem.port for modem in b.plugin.modems] == [b.modems[0].port, b.modems[1].port]
+    assert len(b.plugin.workers) == 2 and b.plugin.outbox is not None
+    assert len(Domoticz.logged('8080 ignored')) == 1
+    assert len(Domoticz.logged("can't open /dev/ttyDOESNOTEXIST")) == 1
+    b.modems[1].deliver('+33601020304', 'cmd fan on')
+    assert b.runUntil(lambda: b.dz.count('switchlight') == 1, 5)
+
+def test_missing_extra_port_cli(bench):
+    b = bench(backend='cli', extra_ports=['/dev/ttyDOESNOTEXIST'])
+    assert [modem.port for modem in b.plugin.modems] == [b.modems[0].port]
+    assert len(b.plugin.workers) == 1
+
+class BlockingSession(StubSession):
+    #First send held until released, then failed
+    def __init__(self, modem):
+        StubSession.__init__(self, modem)
+        self.release = threading.Event()
+        self.calls = 0
+
+    def sendSMS(self, number, text):
+        self.calls += 1
+        if self.calls == 1:
+            self.release.wait(5)
+            return False
+        return StubSession.sendSMS(self, number, text)
+
+def test_retry_merged_with_same_sms(modems):
+    session = modems[0].session = BlockingSession(modems[0])
+    modems[1].session.ready = False
+    outbox = plugin.SMSOutbox(modems[:1], lambda *args: None)
+    outbox.start()
+    first = outbox.send('+33601020304', 'Reboot now')
+    while session.calls == 0:
+        time.sleep(0.01)
+    #Queued again while the first send is in flight, then the first one fails
+    second = outbox.send('+33601020304', 'Reboot now')
+    session.release.set()
+    start = time.time()
+    assert outbox.wait(first, 3) == 'sent'
+    assert time.time()-start < 1
+    assert outbox.wait(second, 3) == 'sent'
+    outbox.stop()
+    assert session.sent == [('+33601020304', 'Reboot now')]
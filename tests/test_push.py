@@ -0,0 +1,41 @@
+#+CMTI push mode on the AT backend
+from harness import Domoticz
+
+def proceeded():
+    return len(Domoticz.logged('Proceed Command'))
+
+def test_single_sms_read_and_deleted(bench):
+    b = bench()
+    modem = b.modems[0]
+    modem.deliver('+33601020304', 'cmd fan on')
+    assert b.runUntil(lambda: proceeded() == 1 and len(modem.storage) == 0, 5)
+
+def test_multipart_parts_kept_until_complete(bench):
+    b = bench()
+    modem = b.modems[0]
+    text = 'cmd fan on / light off '+'.'*200
+    modem.deliver('+33601020304', text, reference=9, order=[1])
+    b.runUntil(lambda: False, 1)
+    assert proceeded() == 0
+    assert len(modem.storage) == 1
+    modem.deliver('+33601020304', text, reference=9, order=[0])
+    assert b.runUntil(lambda: proceeded() == 1 and len(modem.storage) == 0, 5)
+    assert b.dz.count('switchlight') == 2
+    b.runUntil(lambda: False, 0.5)
+    assert proceeded() == 1
+
+def test_restart_reply_sent_before_reboot(bench):
+    b = bench()
+    modem = b.modems[0]
+    answer = b.dz.answer
+    sent_at_reboot = []
+    def recordReboot(path, params):
+        if params.get('param') == 'system_reboot':
+            sent_at_reboot.append(len(modem.sent))
+        return answer(path, params)
+    b.dz.answer = recordReboot
+    modem.deliver('+33601020304', 'cmd restart')
+    assert b.runUntil(lambda: len(sent_at_reboot) == 1, 10)
+    #The 'Reboot now' reply went through the outbox first
+    assert sent_at_reboot == [1]
+    assert list(b.plugin.outbox.status.values())[0] == 'sent'
@@ -0,0 +1,23 @@
+#State queries read the bulk device list of Domoticz, fetched again after a switch
+from harness import Domoticz
+
+def answered(text):
+    return len(Domoticz.logged(text)) > 0
+
+def test_one_round_trip_for_several_queries(bench):
+    b = bench()
+    b.modems[0].deliver('+33601020304', 'cmd fan / light / bedroom light')
+    assert b.runUntil(lambda: answered('Device bedroomlight (IDX:14) is Off'), 10)
+    assert answered('Device fan (IDX:12) is Off') and answered('Device light (IDX:13) is Off')
+    assert b.dz.count('devices') == 1
+
+def test_list_fetched_again_after_switch(bench):
+    b = bench()
+    b.modems[0].deliver('+33601020304', 'cmd fan')
+    assert b.runUntil(lambda: answered('Device fan (IDX:12) is Off'), 10)
+    b.modems[0].deliver('+33601020304', 'cmd fan on')
+    assert b.runUntil(lambda: b.dz.count('switchlight') == 1, 10)
+    #Well within dz_cache_ttl : the cached list was invalidated by the switch
+    b.modems[0].deliver('+33601020304', 'cmd fan')
+    assert b.runUntil(lambda: answered('Device fan (IDX:12) is On'), 10)
+    assert b.dz.count('devices') == 2
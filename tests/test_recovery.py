@@ -0,0 +1,29 @@
+#Full recovery tier : run on the modem worker, the heartbeat never waits for it
+from harness import plugin
+
+def fullRecoveries(b, ok):
+    return [r for r in b.plugin.recoveries if r[1] == 'full' and r[2] == ok]
+
+def test_full_tier_off_the_plugin_thread(bench):
+    #Straight to the full tier, allowed again at once
+    b = bench(settings={'recovery_tiers':['full'], 'recovery_full_interval':0,
+                        'schedule_jobs':{'sms':[20, 0], 'jamming':[3600, 1], 'network':[0.5, 2], 'identify':[21600, 3]}})
+    modem = b.modems[0]
+    b.runUntil(lambda: False, 0.5)
+    before = len(b.latencies)
+    modem.hung = True
+    #Network job times out, then the full tier fails on the dead port
+    assert b.runUntil(lambda: len(fullRecoveries(b, False)) > 0, 40)
+    session = b.plugin.modems[0].session
+    #No fallback to the gammu CLI for good : still an AT session, not ready
+    assert isinstance(session, plugin.ATSession) and not session.ready
+    modem.hung = False
+    assert b.runUntil(lambda: len(fullRecoveries(b, True)) > 0 or b.plugin.modems[0].session.ready, 40)
+    session = b.plugin.modems[0].session
+    assert isinstance(session, plugin.ATSession) and session.ready and session.push
+    assert b.plugin.modems[0].healthy()
+    #Every heartbeat meanwhile only applied the worker results
+    assert max(b.latencies[before:]) < 0.1
+    #Push mode works again
+    modem.deliver('+33601020304', 'cmd fan on')
+    assert b.runUntil(lambda: b.dz.count('switchlight') == 1, 5)
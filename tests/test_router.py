@@ -0,0 +1,64 @@
+#Notification routing : dedup window, digest merge and quota
+import pytest
+
+from harness import plugin
+
+phones = '+33601020304,+33601020305'
+
+@pytest.fixture(autouse=True)
+def timings(monkeypatch):
+    monkeypatch.setattr(plugin, 'timings', plugin.StageTimings())
+    return plugin.timings
+
+def test_routes_by_priority():
+    router = plugin.NotificationRouter(phones)
+    assert router.notify(1, 'door open', 0) == 1
+    assert router.notify(2, 'smoke', 0) == 2
+    assert router.notify(0, 'low', 0) == 0
+
+def test_dedup_window(timings):
+    router = plugin.NotificationRouter(phones)
+    router.notify(1, 'door open', 0)
+    router.notify(1, 'door open', 10)
+    assert timings.counters['notify_duplicate'] == 1
+    assert router.flush(plugin.notify_digest_delay) == [('+33601020304', 'door open')]
+    #Same text again once the window is over
+    later = plugin.notify_dedup_window+1
+    router.notify(1, 'door open', later)
+    assert router.flush(later+plugin.notify_digest_delay) == [('+33601020304', 'door open')]
+    assert timings.counters['notify_duplicate'] == 1
+
+def test_digest_merge(timings):
+    router = plugin.NotificationRouter(phones)
+    router.notify(1, 'door open', 0)
+    router.notify(1, 'window open', 5)
+    router.notify(1, 'garage open', 10)
+    #Held until notify_digest_delay after the first one
+    assert router.flush(plugin.notify_digest_delay-1) == []
+    assert router.flush(plugin.notify_digest_delay) == [('+33601020304', '3 notifications:\ndoor open\nwindow open\ngarage open')]
+    assert timings.counters['notify_merged'] == 2
+    assert router.buffers == {}
+
+def test_urgent_sent_at_once():
+    router = plugin.NotificationRouter(phones)
+    router.notify(1, 'door open', 0)
+    router.notify(2, 'smoke', 1)
+    assert router.flush(1) == [('+33601020304', '2 notifications:\ndoor open\nsmoke'), ('+33601020305', 'smoke')]
+
+def test_quota(timings):
+    router = plugin.NotificationRouter(phones)
+    now = 0
+    sent = 0
+    for i in range(plugin.notify_quota+5):
+        router.notify(1, 'event '+str(i), now)
+        now += plugin.notify_digest_delay
+        sent += len(router.flush(now))
+    assert sent == plugin.notify_quota
+    assert timings.counters['notify_quota'] == 5
+    #Emergency is never held back by the quota
+    router.notify(2, 'smoke', now)
+    assert router.flush(now) == [('+33601020304', 'smoke'), ('+33601020305', 'smoke')]
+    #A new period
+    now += plugin.notify_quota_period+1
+    router.notify(1, 'event again', now)
+    assert len(router.flush(now+plugin.notify_digest_delay)) == 1
@@ -0,0 +1,43 @@
+#Load scenarios on the offline bench : everything processed, the heartbeat never waits for the modem
+import scenarios
+
+def checkLatency(report):
+    assert report['threading_violations'] == 0
+    assert report['heartbeat_p95_ms'] < 20
+
+def test_sms_flood_serial():
+    report = scenarios.smsFlood(count=200)
+    assert report['complete']
+    #'cmd fan toggle / light on' switches two devices, 'cmd bedroom light' only queries one
+    assert report['switchlight_calls'] == 200
+    checkLatency(report)
+
+def test_sms_flood_cli():
+    report = scenarios.smsFlood(count=60, backend='cli', settings={'sms_sweep_interval':1})
+    assert report['complete']
+    assert report['replies_sent'] > 0
+    checkLatency(report)
+
+def test_sms_flood_busy_modem():
+    report = scenarios.smsFlood(count=60, latency=0.005, busy_rate=0.2, settings={'sms_sweep_interval':1})
+    assert report['complete']
+    checkLatency(report)
+
+def test_sms_flood_two_modems():
+    report = scenarios.smsFlood(count=100, modems=2)
+    assert report['complete']
+    checkLatency(report)
+
+def test_notification_storm():
+    report = scenarios.notificationStorm(count=500, distinct=10)
+    assert report['notify_duplicate'] > 400
+    assert report['sms_sent'] <= 20
+    assert report['notify_p95_ms'] < 5
+    checkLatency(report)
+
+def test_hung_modem():
+    report = scenarios.hungModem(hang=12)
+    assert report['back_in_service']
+    assert any(ok for tier, ok, duration in report['recoveries'])
+    assert report['hung_heartbeat_max_ms'] < 50
+    checkLatency(report)
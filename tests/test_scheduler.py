@@ -0,0 +1,64 @@
+#Modem jobs schedule : priorities, busy backoff, fast SMS polling after a command
+from harness import plugin
+
+jobs = {'sms':[20, 0], 'jamming':[60, 1], 'network':[60, 2], 'identify':[21600, 3]}
+
+def test_priority_and_running_jobs():
+    scheduler = plugin.Scheduler(jobs)
+    assert scheduler.due(0) == ['sms', 'jamming', 'network', 'identify']
+    #Still running : not due again
+    assert scheduler.due(100) == []
+    scheduler.done('sms', 0)
+    scheduler.done('network', 0)
+    assert scheduler.due(19) == []
+    assert scheduler.due(20) == ['sms']
+    assert scheduler.due(60) == ['network']
+
+def test_busy_backoff():
+    scheduler = plugin.Scheduler(jobs)
+    scheduler.due(0)
+    for _ in range(10):
+        scheduler.busy()
+    #Doubled on every busy answer, capped at schedule_backoff_max
+    assert scheduler.backoff == plugin.schedule_backoff_max
+    scheduler.done('sms', 0)
+    assert scheduler.jobs['sms']['due'] == 20*plugin.schedule_backoff_max
+    scheduler.idle()
+    scheduler.due(1000)
+    scheduler.done('sms', 1000)
+    assert scheduler.jobs['sms']['due'] == 1020
+
+def test_backoff_steps():
+    scheduler = plugin.Scheduler(jobs)
+    steps = []
+    for _ in range(5):
+        scheduler.busy()
+        steps.append(scheduler.backoff)
+    assert steps == [2, 4, 8, 8, 8]
+
+def test_fast_sms_interval_after_command():
+    scheduler = plugin.Scheduler(jobs)
+    scheduler.setInterval('sms', 300)
+    scheduler.due(0)
+    scheduler.done('sms', 0)
+    assert scheduler.jobs['sms']['due'] == 300
+    #A command brings the next sweep forward, then sweeps every schedule_fast_interval s
+    scheduler.commandReceived(10)
+    assert scheduler.jobs['sms']['due'] == 10+plugin.schedule_fast_interval
+    now = 10+plugin.schedule_fast_interval
+    assert scheduler.due(now) == ['sms']
+    scheduler.done('sms', now)
+    assert scheduler.jobs['sms']['due'] == now+plugin.schedule_fast_interval
+    #Back to the normal interval after schedule_fast_duration s
+    now = 10+plugin.schedule_fast_duration
+    scheduler.due(now)
+    scheduler.done('sms', now)
+    assert scheduler.jobs['sms']['due'] == now+300
+
+def test_fast_interval_not_slowed_by_backoff():
+    scheduler = plugin.Scheduler(jobs)
+    scheduler.due(0)
+    scheduler.busy()
+    scheduler.commandReceived(0)
+    scheduler.done('sms', 1)
+    assert scheduler.jobs['sms']['due'] == 1+plugin.schedule_fast_interval
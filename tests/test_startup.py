@@ -0,0 +1,53 @@
+#Warm restart : the startup cache spares the identify, the .gammurc rewrite and the variable pushes
+import glob
+
+from harness import plugin
+
+identify_commands = ('AT+CGMI', 'AT+CGMM', 'AT+CGMR', 'AT+CGSN', 'AT+CIMI')
+
+def restart(b, **parameters):
+    #onStop, then a new plugin instance started on the same home folder and devices
+    b.plugin.onStop()
+    plugin.Parameters.update(parameters)
+    b.plugin = plugin.BasePlugin()
+    b.plugin.onStart()
+
+def identifies(b):
+    return len([cmd for cmd in b.modems[0].commands if cmd.upper() in identify_commands])
+
+def variableCalls(b):
+    return b.dz.count('updateuservariable')+b.dz.count('adduservariable')
+
+def backups():
+    return set(glob.glob(plugin.gammu_config+'.bakDZ.*'))
+
+def test_warm_restart(bench):
+    b = bench()
+    assert identifies(b) == len(identify_commands)
+    assert variableCalls(b) > 0
+    assert b.plugin.backupfile is None
+    calls, before = variableCalls(b), backups()
+    with open(plugin.gammu_config) as f:
+        config = f.read()
+    restart(b)
+    assert b.plugin.modems[0].session.ready
+    assert b.plugin.modems[0].identity is not None
+    #No identify, no .gammurc backup or write, no variable pushed
+    assert identifies(b) == len(identify_commands)
+    assert b.plugin.backupfile is None and backups() == before
+    with open(plugin.gammu_config) as f:
+        assert f.read() == config
+    assert variableCalls(b) == calls
+    #Still in service
+    b.modems[0].deliver('+33601020304', 'cmd fan on')
+    assert b.runUntil(lambda: b.dz.count('switchlight') == 1, 5)
+
+def test_changed_key_invalidates_cache(bench):
+    b = bench()
+    calls = variableCalls(b)
+    #Another baudrate : the gammu config is rewritten and the module identified again
+    restart(b, Mode1='at9600')
+    assert b.plugin.modems[0].session.ready
+    assert identifies(b) == 2*len(identify_commands)
+    assert b.plugin.backupfile is not None
+    assert variableCalls(b) > calls
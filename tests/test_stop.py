@@ -0,0 +1,46 @@
+#onStop interrupts the modem accesses in progress instead of waiting for their timeouts
+import threading
+import time
+
+import harness
+from harness import Domoticz, plugin
+
+def test_stop_interrupts_serial_send(bench):
+    b = bench()
+    modem = b.modems[0]
+    modem.hung = True
+    b.plugin.outbox.send('+33601020304', 'x'*300)
+    time.sleep(0.5)
+    start = time.time()
+    b.plugin.onStop()
+    b.plugin = None
+    assert time.time()-start < 2
+    assert Domoticz.logged('Still running') == []
+
+def test_stop_kills_gammu_call(bench):
+    b = bench(backend='cli')
+    harness.gammuState(hang=True)
+    b.plugin.outbox.send('+33601020304', 'cmd')
+    time.sleep(1)
+    start = time.time()
+    b.plugin.onStop()
+    b.plugin = None
+    assert time.time()-start < 2
+    assert Domoticz.logged('Still running') == []
+
+def test_threads_still_running_are_logged(bench, monkeypatch):
+    b = bench()
+    monkeypatch.setattr(plugin, 'stop_timeout', 0.2)
+    release = threading.Event()
+    stuck = threading.Thread(target=release.wait, name='GammuDz_stuck', daemon=True)
+    stuck.stop = lambda: None
+    stuck.start()
+    b.plugin.workers.append(stuck)
+    try:
+        start = time.time()
+        b.plugin.onStop()
+        b.plugin = None
+        assert time.time()-start < 1
+        assert len(Domoticz.logged('GammuDz_stuck')) == 1
+    finally:
+        release.set()
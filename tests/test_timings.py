@@ -0,0 +1,27 @@
+#Stage timings shared by the plugin thread and the workers
+import threading
+
+from harness import plugin
+
+def test_report():
+    timings = plugin.StageTimings()
+    for duration in (0.010, 0.020, 0.030):
+        timings.add('poll', duration)
+    timings.count('busy', 2)
+    assert timings.percentiles('poll') == (20, 30, 30)
+    assert timings.report() == 'poll: n=3 p50=20ms p95=30ms max=30ms\nbusy: 2'
+
+def test_report_while_stages_are_added():
+    #New stage names appear from a worker while the report is built : every report stays consistent
+    timings = plugin.StageTimings()
+    def worker():
+        for i in range(3000):
+            timings.add('stage'+str(i), 0.001)
+            timings.count('event'+str(i))
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    while thread.is_alive():
+        for line in timings.report().splitlines():
+            assert line.startswith('stage') and ' n=1 ' in line or line.startswith('event') and line.endswith(': 1')
+    thread.join()
+    assert len(timings.report().splitlines()) == 6000